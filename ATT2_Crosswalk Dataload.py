@@ -1,67 +1,56 @@
 import os
-import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-from matplotlib.colors import Normalize
-import numpy as np
 
-BASE_DIR = os.path.dirname(os.path.abspath(__name__))
+from changes import changes_frame
+from charts import chart_job, render_charts
+from ranking import top_k
+from workbook import read_sheet
 
-# Loading Dataset
-sec_attempt = os.path.join(BASE_DIR,"2nd Attempt", "Consolidated Dataset_v2.xlsx")
 
-# Loading the dataset
-puma_df = pd.read_excel(sec_attempt, sheet_name = "Aggr Values from_Tr 2022 Data", header = 5)
+# The chart pool's workers re-import this file on start-up (spawn, the default on
+# Windows and macOS), so the script itself only runs as __main__
+if __name__ == "__main__":
+    BASE_DIR = os.path.dirname(os.path.abspath(__name__))
 
-## Clearing all NAN Values
-puma_vals =puma_df[19:]
+    # Loading Dataset
+    sec_attempt = os.path.join(BASE_DIR,"2nd Attempt", "Consolidated Dataset_v2.xlsx")
 
-puma_vals.head()
+    # Loading the dataset (cached as a Parquet snapshot until the workbook changes);
+    # the first 19 rows under the header are NaN and are skipped
+    puma_vals = read_sheet(sec_attempt, sheet_name = "Aggr Values from_Tr 2022 Data", header = 5, skip_rows = 19)
 
-# Restricting the dataset to the necessary columns
-puma_vals_wide = puma_vals[['State abbr.',  'PUMA12 name',           2012,
-                 2013,           2014,           2015,           2016,
-                 2017,           2018,           2019,           2021,
-                 2022,           2023]]
+    puma_vals.head()
 
-# Rounding the values to the nearest integer
-puma_vals_wide[2022]=puma_vals_wide[2022].round(0)
-puma_vals_wide[2023]=puma_vals_wide[2023].round(0)
+    # Restricting the dataset to the necessary columns
+    puma_vals_wide = puma_vals[['State abbr.',  'PUMA12 name',           2012,
+                     2013,           2014,           2015,           2016,
+                     2017,           2018,           2019,           2021,
+                     2022,           2023]]
 
-# Identifying 2023 v 2022 changes
-puma_vals_wide['Abs_2023v2012'] = puma_vals_wide[2023] - puma_vals_wide[2012]
-puma_vals_wide['Pct_2023v2012'] = (puma_vals_wide[2023] - puma_vals_wide[2012])*100/puma_vals_wide[2012]
+    # Rounding the values to the nearest integer
+    puma_vals_wide[2022]=puma_vals_wide[2022].round(0)
+    puma_vals_wide[2023]=puma_vals_wide[2023].round(0)
 
-# Identifying 2023 v 2019 changes
-puma_vals_wide['Abs_2023v2019'] = puma_vals_wide[2023] - puma_vals_wide[2019]
-puma_vals_wide['Pct_2023v2019'] = (puma_vals_wide[2023] - puma_vals_wide[2019])*100/puma_vals_wide[2019]
+    # Identifying 2023 v 2012 and 2023 v 2019 changes (Abs_2023v2012, Pct_2023v2012, ...)
+    puma_years = [2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019, 2021, 2022, 2023]
+    puma_vals_wide = puma_vals_wide.join(changes_frame(puma_vals_wide, {yr: yr for yr in puma_years},
+                                                       pairs=[(2012, 2023), (2019, 2023)],
+                                                       metrics=("abs", "pct")))
 
-puma_vals_wide.head()
+    puma_vals_wide.head()
 
-# Identifying the top 20 PUMA with the highest percentage change in household count from 2019 to 2023
-top_20_change_23v19 = puma_vals_wide.sort_values(by = 'Pct_2023v2019', ascending = False).head(20)
+    # Identifying the top 20 PUMA with the highest percentage change in household count from 2019 to 2023
+    top_20_change_23v19 = top_k(puma_vals_wide, 'Pct_2023v2019', 20)
 
-# Plotting the top 20 PUMA with the highest percentage change in household count from 2019 to 2023
-plt.figure(figsize=(15, 10))    
-plt.bar(top_20_change_23v19['PUMA12 name'], top_20_change_23v19['Pct_2023v2019'])
-plt.ylabel('Percentage Change in Household Count')
-plt.xlabel('PUMA')
-plt.xticks(rotation=90)
-plt.title('Top 20 PUMA with the Highest Percentage Change in Household Count from 2019 to 2023')
-plt.tight_layout()
-# plt.savefig(os.path.join(BASE_DIR, "Output", "Top 20 PUMA with the Highest Percentage Change in Household Count from 2019 to 2023.png"))
-plt.show()
+    # Identifying the top 20 PUMA with the highest percentage change in household count from 2012 to 2023
+    top_20_change_23v12 = top_k(puma_vals_wide, 'Pct_2023v2012', 20)
 
-# Identifying the top 20 PUMA with the highest percentage change in household count from 2012 to 2023
-top_20_change_23v12 = puma_vals_wide.sort_values(by = 'Pct_2023v2012', ascending = False).head(20)
-
-# Plotting the top 20 PUMA with the highest percentage change in household count from 2012 to 2023
-plt.figure(figsize=(15, 10))
-plt.bar(top_20_change_23v12['PUMA12 name'], top_20_change_23v12['Pct_2023v2012'])
-plt.ylabel('Percentage Change in Household Count')
-plt.xlabel('PUMA')
-plt.xticks(rotation=90)
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+    # Drawing both top 20 PUMA charts headlessly and saving them to Output as PNG and SVG
+    chart_jobs = []
+    for top, col, period in [(top_20_change_23v19, 'Pct_2023v2019', 'from 2019 to 2023'),
+                                 (top_20_change_23v12, 'Pct_2023v2012', 'from 2012 to 2023')]:
+        title = f'Top 20 PUMA with the Highest Percentage Change in Household Count {period}'
+        for fmt in ('png', 'svg'):
+            chart_jobs.append(chart_job(top['PUMA12 name'], top[col], title,
+                                        os.path.join(BASE_DIR, "Output", f'{title}.{fmt}'),
+                                        xlabel='PUMA', key=title))
+    render_charts(chart_jobs)
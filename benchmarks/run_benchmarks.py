@@ -0,0 +1,202 @@
+"""Stage-by-stage benchmarks on synthetic ACS S1901 panels.
+
+    python benchmarks/run_benchmarks.py                        # PUMA and tract scale
+    python benchmarks/run_benchmarks.py --scales 2400 --repeat 5 --out bench.json
+
+Each stage (CSV ingest, long/wide build, crosswalk allocation, change metrics,
+top-k selection, per-frame map rendering) is timed on its own against
+synthetic files that use the real column layout, and the results are written
+as JSON so two runs can be compared.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+from changes import compute_changes  # noqa: E402
+from crosswalk import Crosswalk, geo_id_to_key  # noqa: E402
+from ranking import RankIndex, top_k_indices  # noqa: E402
+
+YEARS = ingest.YEARS
+
+# ~2,400 PUMAs today, ~85,000 census tracts next
+DEFAULT_SCALES = [2400, 85000]
+
+
+# ---- synthetic data ----
+
+def s1901_columns():
+    cols = ["GEO_ID", "NAME"]
+    for c in (1, 2, 3, 4):
+        for i in range(1, 17):
+            cols += [f"S1901_C0{c}_{i:03d}E", f"S1901_C0{c}_{i:03d}M"]
+    return cols
+
+
+def write_synthetic_year(path, n_geo, year, rng):
+    """One year's CSV in the data.census.gov export layout (header + label row)."""
+    cols = s1901_columns()
+    keys = [f"{i // 1000 + 1:02d}{i % 1000 * 10 + 100:05d}" for i in range(n_geo)]
+    data = {"GEO_ID": [f"7950000US{k}" for k in keys],
+            "NAME": [f"Area {k}; State {k[:2]}" for k in keys]}
+    households = rng.integers(20000, 120000, n_geo)
+    for col in cols[2:]:
+        if col == "S1901_C01_001E":
+            data[col] = households
+        elif col.endswith("E"):
+            data[col] = np.round(rng.uniform(0, 30, n_geo), 1)
+        else:
+            data[col] = np.round(rng.uniform(0, 5, n_geo), 1)
+    df = pd.DataFrame(data)[cols]
+    with open(path, "w", newline="") as f:
+        f.write(",".join(f'"{c}"' for c in cols) + "\n")
+        f.write(",".join(f'"Label {c}"' for c in cols) + "\n")
+        df.to_csv(f, header=False, index=False)
+    return keys
+
+
+def synthetic_crosswalk(keys, rng, n_target=None, split=0.3):
+    """Source -> target pairs where ~`split` of the sources are split across two targets."""
+    n_src = len(keys)
+    n_target = n_target or max(1, n_src // 3)
+    tgt = rng.integers(0, n_target, n_src)
+    two = rng.random(n_src) < split
+    frac = np.where(two, rng.uniform(0.2, 0.8, n_src), 1.0)
+    src = np.concatenate([keys, np.asarray(keys)[two]])
+    target = np.concatenate([tgt, rng.integers(0, n_target, two.sum())])
+    factor = np.concatenate([frac, 1 - frac[two]])
+    return Crosswalk.from_pairs(src, [f"{t:05d}" for t in target], factor, name="synthetic")
+
+
+# ---- timing ----
+
+def timeit(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return {"min_s": min(times), "median_s": statistics.median(times), "repeat": repeat}, result
+
+
+def bench_scale(n_geo, repeat, render, rng):
+    results = {}
+    with tempfile.TemporaryDirectory() as raw_dir:
+        for yr in YEARS:
+            keys = write_synthetic_year(os.path.join(raw_dir, f"{yr}.csv"), n_geo, yr, rng)
+        cols = ["GEO_ID", "NAME", "S1901_C01_001E", "S1901_C01_001M", "S1901_C01_013E"]
+        first = os.path.join(raw_dir, f"{YEARS[0]}.csv")
+
+        results["csv_parse_one_year"], _ = timeit(lambda: ingest.parse_acs_csv(first), repeat)
+        ingest.load_years(YEARS, raw_dir=raw_dir)  # warm the Parquet cache
+        results["cached_read_all_years"], _ = timeit(
+            lambda: ingest.load_years(YEARS, columns=cols, raw_dir=raw_dir), repeat)
+        results["build_long"], df_long = timeit(
+            lambda: ingest.build_long(YEARS, columns=cols, raw_dir=raw_dir), repeat)
+        results["build_wide"], wide = timeit(
+            lambda: ingest.build_wide(df_long, values={"NAME": "NAME",
+                                                       "S1901_C01_001E": "Household_ct",
+                                                       "S1901_C01_013E": "Mean_Income"}),
+            repeat)
+
+    values = wide[[f"Household_ct_{yr}" for yr in YEARS]].to_numpy(dtype="float64")
+    geo_keys = geo_id_to_key(wide["GEO_ID"])
+
+    results["crosswalk_build"], xwalk = timeit(lambda: synthetic_crosswalk(keys, rng), repeat)
+    results["crosswalk_allocate_all_years"], _ = timeit(
+        lambda: xwalk.apply(values, keys=geo_keys), repeat)
+    composed = xwalk.then(synthetic_crosswalk(list(xwalk.target), rng))
+    results["crosswalk_allocate_composed"], _ = timeit(
+        lambda: composed.apply(values, keys=geo_keys), repeat)
+
+    results["change_metrics_all_pairs"], (scores, pairs) = timeit(
+        lambda: compute_changes(values, YEARS), repeat)
+    pct = scores["pct"][:, pairs.index((2019, 2023))]
+    results["top20_argpartition"], _ = timeit(lambda: top_k_indices(pct, 20), repeat)
+    results["top20_full_sort"], _ = timeit(
+        lambda: pd.Series(pct).sort_values(ascending=False).head(20), repeat)
+    results["rank_index_build"], index = timeit(lambda: RankIndex(values, YEARS), repeat)
+    results["rank_index_query"], _ = timeit(lambda: index.top("pct", 2019, 2023, 20), repeat)
+
+    if render:
+        results.update(bench_render(n_geo, repeat, rng))
+    return results
+
+
+def bench_render(n_geo, repeat, rng):
+    """Per-frame cost of the reusable basemap (skipped if cartopy is missing)."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        from map_render import BaseMap
+    except ImportError as exc:
+        return {"render": {"skipped": str(exc)}}
+    lon = rng.uniform(-124, -67, n_geo)
+    lat = rng.uniform(25, 49, n_geo)
+    try:
+        t0 = time.perf_counter()
+        base = BaseMap(lon, lat, 25367, 120000)
+        setup = time.perf_counter() - t0
+
+        def frame():
+            base.update(rng.uniform(25000, 120000, n_geo), "Benchmark frame", "Households")
+            buf = io.BytesIO()
+            base.fig.savefig(buf, format="png", dpi=100)
+
+        stats, _ = timeit(frame, repeat)
+        base.close()
+    except Exception as exc:  # e.g. Natural Earth data cannot be downloaded
+        return {"render": {"skipped": f"{type(exc).__name__}: {exc}"}}
+    return {"render_basemap_setup": {"min_s": setup, "median_s": setup, "repeat": 1},
+            "render_frame_png_100dpi": stats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="comma-separated geography counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-render", action="store_true", help="skip the map stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "years": YEARS,
+        "scales": {},
+    }
+    for n_geo in [int(s) for s in args.scales.split(",")]:
+        print(f"[bench] {n_geo} geographies x {len(YEARS)} years")
+        report["scales"][str(n_geo)] = bench_scale(n_geo, args.repeat, not args.no_render, rng)
+        for stage, stats in report["scales"][str(n_geo)].items():
+            if "median_s" in stats:
+                print(f"  {stage:32s} {stats['median_s'] * 1000:10.2f} ms")
+            else:
+                print(f"  {stage:32s} skipped ({stats['skipped']})")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"[bench] results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
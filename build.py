@@ -0,0 +1,192 @@
+"""Incremental build of the household panel, county allocation, change metrics and maps.
+
+    python build.py                 # bring everything up to date
+    python build.py county_map_2023 # one artifact and whatever it needs
+    python build.py --force         # rebuild everything
+
+Revising Raw Data/2022.csv only reruns panel_2022, county_2022 and the 2022/2023
+change steps and maps that depend on it.
+
+Years come from the csv files in Raw Data. Dropping in a new release (2024.csv)
+adds panel_2024, county_2024 and the 2024 change and map, and appends 2024 to
+panel_wide, panel_store and rollups instead of rebuilding them over every year.
+"""
+import os
+import sys
+
+import pandas as pd
+
+import crosswalk
+from changes import compute_changes, yoy_pairs
+from ingest import (CACHE_VERSION, RAW_DIR, WIDE_VALUES, available_years, build_wide, read_year,
+                    with_moe)
+from panel_store import PanelStore
+from pipeline import Pipeline
+from rollup import FIRST_COUNTY_YEAR, append_rollups, build_rollups
+from spatial import CONUS_BBOX, PointIndex
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(BASE_DIR, "build")
+STATE_PATH = os.path.join(BUILD_DIR, "pipeline_state.json")
+
+PANEL_COLUMNS = with_moe([
+    'GEO_ID', 'NAME', 'S1901_C01_001E', 'S1901_C01_002E', 'S1901_C01_003E', 'S1901_C01_004E',
+    'S1901_C01_005E', 'S1901_C01_006E', 'S1901_C01_007E', 'S1901_C01_008E', 'S1901_C01_009E',
+    'S1901_C01_010E', 'S1901_C01_011E', 'S1901_C01_012E', 'S1901_C01_013E'
+])
+
+# Estimates kept in the memory-mapped panel store (MOEs ride along)
+STORE_VARIABLES = [c for c in PANEL_COLUMNS if c.endswith("E") and c.startswith("S")]
+STORE_DIR = os.path.join(BUILD_DIR, "panel_store")
+ROLLUP_PATH = os.path.join(BUILD_DIR, "rollups.parquet")
+
+CROSSWALK_INPUTS = [crosswalk.PUMA12_TO_PUMA22_CSV, crosswalk.PUMA22_TO_COUNTY_CSV]
+
+
+def panel_path(yr):
+    return os.path.join(BUILD_DIR, "panel", f"{yr}.parquet")
+
+
+def county_path(yr):
+    return os.path.join(BUILD_DIR, "county", f"{yr}.parquet")
+
+
+def change_path(base, target):
+    return os.path.join(BUILD_DIR, "changes", f"county_pct_change_{target}v{base}.parquet")
+
+
+def map_path(base, target):
+    return os.path.join(BUILD_DIR, "figures", f"county_pct_change_{target}v{base}")
+
+
+def _write_parquet(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path)
+
+
+# ---- step functions ----
+
+def build_panel_year(yr, raw_dir=RAW_DIR, cache_version=CACHE_VERSION):
+    # cache_version is only there to be in the step's signature, so a change
+    # to the csv conversion rebuilds every year
+    _write_parquet(read_year(yr, columns=PANEL_COLUMNS, raw_dir=raw_dir), panel_path(yr))
+
+
+def _panel_wide(years):
+    df_long = pd.concat([pd.read_parquet(panel_path(yr)).assign(Year=yr) for yr in years],
+                        ignore_index=True)
+    return build_wide(df_long)
+
+
+def build_panel_wide(years, path):
+    _write_parquet(_panel_wide(years), path)
+
+
+def append_panel_wide(added, years, path):
+    # Only the new years are pivoted; the existing columns are copied over
+    wide = pd.read_parquet(path).merge(_panel_wide(added), on="GEO_ID", how="outer")
+    cols = [f"{name}_{yr}" for yr in years for name in WIDE_VALUES.values()]
+    _write_parquet(wide[["GEO_ID"] + cols], path)
+
+
+def build_panel_store(years, path):
+    frames = {yr: pd.read_parquet(panel_path(yr)) for yr in years}
+    PanelStore.from_frames(path, frames, STORE_VARIABLES)
+
+
+def append_panel_store(added, years, path):
+    PanelStore.append_years(path, {yr: pd.read_parquet(panel_path(yr)) for yr in added})
+
+
+def build_rollup_table(years, path):
+    build_rollups(PanelStore(STORE_DIR), path, years)
+
+
+def append_rollup_table(added, years, path):
+    append_rollups(PanelStore(STORE_DIR), path, added)
+
+
+def build_county_year(yr):
+    xwalk = crosswalk.puma_to_county_for_year(yr)
+    panel = pd.read_parquet(panel_path(yr), columns=["GEO_ID", "S1901_C01_001E"])
+    panel.index = crosswalk.geo_id_to_key(panel["GEO_ID"])
+    out = xwalk.allocate(panel.fillna({"S1901_C01_001E": 0}), ["S1901_C01_001E"])
+    _write_parquet(out.rename(columns={"S1901_C01_001E": "Household_ct"}), county_path(yr))
+
+
+def build_county_change(base, target):
+    both = pd.concat([pd.read_parquet(county_path(yr))["Household_ct"].rename(yr)
+                      for yr in (base, target)], axis=1)
+    out, _ = compute_changes(both.to_numpy(), [base, target], metrics=("abs", "pct"))
+    _write_parquet(pd.DataFrame({"Abs": out["abs"][:, 0], "Pct": out["pct"][:, 0]},
+                                index=both.index), change_path(base, target))
+
+
+def build_county_map(base, target):
+    from map_render import map_job, render_maps
+
+    change = pd.read_parquet(change_path(base, target))
+    pts = crosswalk.county_centroids().reindex(change.index)
+    keep = PointIndex.from_frame(pts).mask_bbox(*CONUS_BBOX)
+    label = f'Percent Change in Household Counts ({base} to {target})'
+    jobs = [map_job(change["Pct"][keep], label, label, f"{map_path(base, target)}.{fmt}",
+                    vmin=-25, vmax=25, cmap='RdYlBu_r', tick_fmt='{x:,.1f}%')
+            for fmt in ("png", "svg")]
+    render_maps(jobs, pts["IntPtLon"][keep], pts["IntPtLat"][keep], workers=1)
+
+
+# ---- graph ----
+
+def make_pipeline(years=None, raw_dir=RAW_DIR):
+    if years is None:
+        years = available_years(raw_dir)
+    pipe = Pipeline(STATE_PATH)
+    for yr in years:
+        pipe.add(f"panel_{yr}", build_panel_year,
+                 params={"yr": yr, "raw_dir": raw_dir, "cache_version": CACHE_VERSION},
+                 inputs=[os.path.join(raw_dir, f"{yr}.csv")], outputs=[panel_path(yr)])
+
+    wide_path = os.path.join(BUILD_DIR, "panel_wide.parquet")
+    pipe.add("panel_wide", build_panel_wide, params={"years": list(years), "path": wide_path},
+             deps=[f"panel_{yr}" for yr in years], outputs=[wide_path],
+             append=append_panel_wide, grows="years")
+
+    pipe.add("panel_store", build_panel_store, params={"years": list(years), "path": STORE_DIR},
+             deps=[f"panel_{yr}" for yr in years],
+             outputs=[os.path.join(STORE_DIR, name) for name in ("values.npy", "moes.npy",
+                                                                  "meta.json")],
+             append=append_panel_store, grows="years")
+
+    pipe.add("rollups", build_rollup_table, params={"years": list(years), "path": ROLLUP_PATH},
+             inputs=CROSSWALK_INPUTS, deps=["panel_store"], outputs=[ROLLUP_PATH],
+             append=append_rollup_table, grows="years")
+
+    # Releases before 2012 use the 2000 PUMAs, which the crosswalk files do not cover
+    county_years = [yr for yr in years if yr >= FIRST_COUNTY_YEAR]
+    for yr in county_years:
+        pipe.add(f"county_{yr}", build_county_year, params={"yr": yr},
+                 inputs=CROSSWALK_INPUTS, deps=[f"panel_{yr}"], outputs=[county_path(yr)])
+
+    for base, target in yoy_pairs(county_years):
+        pipe.add(f"county_change_{target}v{base}", build_county_change,
+                 params={"base": base, "target": target},
+                 deps=[f"county_{base}", f"county_{target}"],
+                 outputs=[change_path(base, target)])
+        pipe.add(f"county_map_{target}", build_county_map,
+                 params={"base": base, "target": target},
+                 inputs=[crosswalk.PUMA22_TO_COUNTY_CSV],
+                 deps=[f"county_change_{target}v{base}"],
+                 outputs=[f"{map_path(base, target)}.{fmt}" for fmt in ("png", "svg")],
+                 process=True)
+    return pipe
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    force = "--force" in args
+    targets = [a for a in args if not a.startswith("--")] or None
+    status = make_pipeline().run(targets, force=force)
+    ran = sorted(name for name, s in status.items() if s != "skipped")
+    appended = sum(s == "appended" for s in status.values())
+    print(f"{len(ran)} step(s) rebuilt ({appended} by appending), "
+          f"{len(status) - len(ran)} up to date")
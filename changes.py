@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from instrument import traced
+
+# Metric name -> column prefix used in the analysis scripts (Abs_2023v2019, ...)
+METRICS = {"abs": "Abs", "pct": "Pct", "cagr": "CAGR"}
+
+
+def all_pairs(years):
+    """Every (base, target) pair with base < target, e.g. (2019, 2023)."""
+    years = sorted(years)
+    return [(b, t) for i, b in enumerate(years) for t in years[i + 1:]]
+
+
+def yoy_pairs(years):
+    """Consecutive pairs of the available years.
+
+    Years with no data are skipped rather than filled, so with 2020 missing
+    the 2021 change is measured against 2019.
+    """
+    years = sorted(years)
+    return list(zip(years[:-1], years[1:]))
+
+
+def pair_indices(years, pairs=None):
+    """Column positions of the base and target year of each pair."""
+    years = list(years)
+    if pairs is None:
+        pairs = all_pairs(years)
+    pos = {yr: i for i, yr in enumerate(years)}
+    missing = sorted({yr for pair in pairs for yr in pair if yr not in pos})
+    if missing:
+        raise ValueError(f"No data for year(s) {missing}; available years are {years}")
+    base_idx = np.array([pos[b] for b, _ in pairs], dtype=np.intp)
+    target_idx = np.array([pos[t] for _, t in pairs], dtype=np.intp)
+    return base_idx, target_idx, list(pairs)
+
+
+@traced("changes.compute_changes")
+def compute_changes(values, years, pairs=None, metrics=tuple(METRICS)):
+    """Change metrics for many year pairs at once.
+
+    `values` is a (geography x year) array whose columns follow `years`.
+    Returns ({metric: (geography x pair) array}, pairs). Percent and CAGR are
+    in percent; both are NaN wherever the base value is 0, negative (CAGR) or
+    missing, so a zero base never produces inf.
+    """
+    values = np.asarray(values, dtype="float64")
+    base_idx, target_idx, pairs = pair_indices(years, pairs)
+    base = values[:, base_idx]
+    target = values[:, target_idx]
+    diff = target - base
+
+    out = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if "abs" in metrics:
+            out["abs"] = diff
+        if "pct" in metrics:
+            out["pct"] = np.where(base != 0, diff * 100 / base, np.nan)
+        if "cagr" in metrics:
+            # Spans use calendar years, so 2019 -> 2021 is 2 years despite the 2020 gap
+            span = np.array([t - b for b, t in pairs], dtype="float64")
+            ok = (base > 0) & (target >= 0)
+            ratio = np.where(ok, target / np.where(ok, base, 1), np.nan)
+            out["cagr"] = (ratio ** (1 / span) - 1) * 100
+    return out, pairs
+
+
+def year_columns(df, template, years):
+    """{year: column} for wide frames, e.g. template 'House_ct_{year}' or 'Count_{yy}'."""
+    return {yr: template.format(year=yr, yy=f"{yr % 100:02d}") for yr in years}
+
+
+def changes_frame(df, columns, pairs=None, metrics=tuple(METRICS), names=METRICS,
+                  fmt="{name}_{target}v{base}"):
+    """Change columns for a wide frame, named like 'Pct_2023v2019'.
+
+    `columns` maps year -> column of `df` holding that year's value. `fmt` can
+    also use {tt}/{bb} for two-digit years ('pct_change_{tt}v{bb}'). The result
+    has the same index as `df` so it can be joined straight back.
+    """
+    years = sorted(columns)
+    values = df[[columns[yr] for yr in years]].to_numpy(dtype="float64")
+    out, pairs = compute_changes(values, years, pairs=pairs, metrics=metrics)
+    data = {}
+    for metric in metrics:
+        for j, (b, t) in enumerate(pairs):
+            label = fmt.format(name=names[metric], base=b, target=t,
+                               bb=f"{b % 100:02d}", tt=f"{t % 100:02d}")
+            data[label] = out[metric][:, j]
+    return pd.DataFrame(data, index=df.index)
@@ -0,0 +1,246 @@
+"""Headless, parallel top-N bar charts.
+
+    python charts.py                                   # every YoY pair, every state, counties
+    python charts.py --levels county,puma --pairs 2019-2023,2022-2023 --states CA,TX -n 10
+    python charts.py --pairs all --bottom --workers 8
+
+Charts are drawn on matplotlib Figure objects that are never attached to
+pyplot, so nothing opens a window or blocks on show(). Each worker process
+keeps one bar-chart template and only swaps bar heights, tick labels and
+titles between charts. A spec is (level, metric, base, target, n) plus an
+optional state and direction; chart_specs() expands the nightly grid of
+them and spec_jobs() turns specs into the rows to plot.
+"""
+import argparse
+import os
+import re
+
+import numpy as np
+
+from instrument import span
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(BASE_DIR, "output_charts")
+
+LEVEL_LABELS = {"county": ("County", "Counties"), "puma": ("PUMA", "PUMAs")}
+METRIC_LABELS = {
+    "pct": "Percentage Change in Household Count",
+    "abs": "Change in Household Count",
+    "cagr": "Annual Growth Rate of Household Count (%)",
+}
+
+# Per-process template, created on the first chart a worker draws
+_TEMPLATE = {}
+
+
+def chart_job(labels, values, title, path, ylabel=METRIC_LABELS["pct"], xlabel="County",
+              dpi=100, key=None):
+    """One bar chart: bar labels and heights, axis text and an output path.
+
+    Jobs with the same `key` (e.g. the PNG and SVG of one chart) are drawn
+    once and saved in each format.
+    """
+    return {
+        "labels": [str(x) for x in labels], "values": np.asarray(values, dtype="float64"),
+        "title": title, "ylabel": ylabel, "xlabel": xlabel, "path": path, "dpi": dpi,
+        "key": key if key is not None else os.path.splitext(path)[0],
+    }
+
+
+def chart_spec(level, metric, base, target, n=20, state=None, largest=True):
+    return {"level": level, "metric": metric, "base": base, "target": target, "n": n,
+            "state": state, "largest": largest}
+
+
+def chart_specs(levels=("county",), metrics=("pct",), pairs=(), states=(None,), n=20,
+                largest=True):
+    """Every combination of level, metric, year pair and state (None = national)."""
+    return [chart_spec(level, metric, base, target, n, state, largest)
+            for level in levels for metric in metrics for base, target in pairs
+            for state in states]
+
+
+def _title(spec):
+    _, plural = LEVEL_LABELS[spec["level"]]
+    which = "Top" if spec["largest"] else "Bottom"
+    most = "Highest" if spec["largest"] else "Lowest"
+    where = f" in {spec['state']}" if spec["state"] else ""
+    return (f"{which} {spec['n']} {plural}{where} with the {most}\n"
+            f"{METRIC_LABELS[spec['metric']]} from {spec['base']} to {spec['target']}")
+
+
+def _spec_path(spec, out_dir, fmt):
+    name = (f"{spec['level']}_{spec['metric']}_{'top' if spec['largest'] else 'bottom'}"
+            f"{spec['n']}_{spec['target']}v{spec['base']}")
+    return os.path.join(out_dir, spec["level"], spec["state"] or "US", f"{name}.{fmt}")
+
+
+def spec_jobs(specs, out_dir=OUTPUT_DIR, formats=("png", "svg"), panels=None):
+    """Chart jobs for specs, ranking each level's panel once with a RankIndex.
+
+    `panels` maps level -> tables.household_panel frame and is loaded when
+    not given. Specs whose filters leave no rows are skipped.
+    """
+    from ranking import RankIndex
+    from tables import household_panel
+
+    panels = dict(panels or {})
+    indexes = {}
+    jobs = []
+    for spec in specs:
+        level = spec["level"]
+        if level not in indexes:
+            if level not in panels:
+                panels[level] = household_panel(level)
+            frame = panels[level]
+            cols = {int(c.rsplit("_", 1)[1]): c for c in frame.columns
+                    if c.startswith("Household_ct_")}
+            indexes[level] = RankIndex.from_frame(frame, cols, state_col="stab")
+        res = indexes[level].query(spec["metric"], spec["base"], spec["target"], spec["n"],
+                                   largest=spec["largest"], state=spec["state"])
+        if res.empty:
+            continue
+        labels = panels[level]["name"].reindex(res.index).fillna(res.index.to_series())
+        for fmt in formats:
+            path = _spec_path(spec, out_dir, fmt)
+            jobs.append(chart_job(labels, res[spec["metric"]], _title(spec), path,
+                                  ylabel=METRIC_LABELS[spec["metric"]],
+                                  xlabel=LEVEL_LABELS[level][0], key=os.path.splitext(path)[0]))
+    return jobs
+
+
+class BarChart:
+    """A bar chart built once and re-filled for every chart a worker draws."""
+
+    def __init__(self, n_bars=20, figsize=(15, 10)):
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=figsize)
+        self.ax = self.fig.add_subplot()
+        self.bars = self.ax.bar(np.arange(n_bars), np.zeros(n_bars))
+        self.ax.tick_params(axis="x", labelrotation=90)
+
+    def __len__(self):
+        return len(self.bars)
+
+    def update(self, job):
+        values = job["values"]
+        n = len(values)
+        for i, rect in enumerate(self.bars):
+            rect.set_visible(i < n)
+            rect.set_height(values[i] if i < n and not np.isnan(values[i]) else 0)
+        self.ax.set_xticks(np.arange(n))
+        self.ax.set_xticklabels(job["labels"])
+        self.ax.set_xlim(-0.6, max(n, 1) - 0.4)
+        finite = values[~np.isnan(values)]
+        lo, hi = min(0.0, finite.min(initial=0)), max(0.0, finite.max(initial=0))
+        pad = 0.05 * (hi - lo or 1)
+        self.ax.set_ylim(lo - pad if lo < 0 else 0, hi + pad)
+        self.ax.set_title(job["title"])
+        self.ax.set_ylabel(job["ylabel"])
+        self.ax.set_xlabel(job["xlabel"])
+        self.fig.tight_layout()
+
+    def save(self, path, dpi=100):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.fig.savefig(path, dpi=dpi)
+        return path
+
+
+def render_chart(job):
+    """Draw one job on this process's template (re-filled only when the key changes)."""
+    chart = _TEMPLATE.get("chart")
+    if chart is None or len(chart) < len(job["values"]):
+        chart = _TEMPLATE["chart"] = BarChart(max(20, len(job["values"])))
+    if _TEMPLATE.get("key") != job["key"]:
+        with span("chart.update", key=str(job["key"])):
+            chart.update(job)
+        _TEMPLATE["key"] = job["key"]
+    with span("chart.savefig", path=os.path.basename(job["path"])):
+        return chart.save(job["path"], job["dpi"])
+
+
+def render_charts(jobs, workers=None):
+    """Render chart jobs across a process pool; returns the saved paths in job order.
+
+    `workers` defaults to the CPU count; workers=1 renders in this process.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    with span("chart.render_charts", jobs=len(jobs), workers=workers):
+        if workers == 1:
+            try:
+                return [render_chart(job) for job in jobs]
+            finally:
+                _TEMPLATE.clear()
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Keep every format of a chart in the same chunk so it is drawn once
+        per_key = max(1, len(jobs) // len({job["key"] for job in jobs}))
+        chunk = per_key * max(1, len(jobs) // (per_key * workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(render_chart, jobs, chunksize=chunk))
+
+
+def _parse_pairs(text, years):
+    from changes import all_pairs, yoy_pairs
+
+    if text == "yoy":
+        return yoy_pairs(years)
+    if text == "all":
+        return all_pairs(years)
+    pairs = []
+    for item in text.split(","):
+        m = re.fullmatch(r"(\d{4})-(\d{4})", item.strip())
+        if not m:
+            raise SystemExit(f"bad pair {item!r}; use e.g. 2019-2023")
+        pairs.append((int(m.group(1)), int(m.group(2))))
+    return pairs
+
+
+def main(argv=None):
+    from tables import household_panel
+
+    parser = argparse.ArgumentParser(description="Batch top-N bar charts")
+    parser.add_argument("--levels", default="county", help="comma-separated: county,puma")
+    parser.add_argument("--metrics", default="pct", help="comma-separated: pct,abs,cagr")
+    parser.add_argument("--pairs", default="yoy", help="'yoy', 'all' or e.g. 2019-2023,2022-2023")
+    parser.add_argument("--states", default="all",
+                        help="'all' (national + every state) or e.g. US,CA,TX (US is national)")
+    parser.add_argument("-n", type=int, default=20)
+    parser.add_argument("--bottom", action="store_true", help="largest declines instead")
+    parser.add_argument("--formats", default="png,svg")
+    parser.add_argument("--out", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+
+    levels = args.levels.split(",")
+    panels = {level: household_panel(level) for level in levels}
+    years = sorted(int(c.rsplit("_", 1)[1]) for c in panels[levels[0]].columns
+                   if c.startswith("Household_ct_"))
+    known = sorted(set().union(*(p["stab"].dropna() for p in panels.values())))
+    if args.states == "all":
+        states = [None] + known
+    else:
+        # "US" anywhere in the list is the national chart
+        states = [None if st == "US" else st
+                  for st in dict.fromkeys(item.strip().upper() for item in args.states.split(","))]
+        unknown = [st for st in states if st is not None and st not in known]
+        if unknown:
+            parser.error(f"unknown state abbreviation(s): {', '.join(unknown)}")
+
+    specs = chart_specs(levels, args.metrics.split(","), _parse_pairs(args.pairs, years),
+                        states, args.n, largest=not args.bottom)
+    jobs = spec_jobs(specs, args.out, tuple(args.formats.split(",")), panels=panels)
+    paths = render_charts(jobs, workers=args.workers)
+    print(f"[charts] {len(paths)} file(s) from {len(specs)} spec(s) written under {args.out}")
+
+
+if __name__ == "__main__":
+    main()
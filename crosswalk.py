@@ -0,0 +1,284 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrument import span
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CROSSWALK_DIR = os.path.join(BASE_DIR, "Raw Data", "Cross Walk Dataset")
+
+PUMA12_TO_PUMA22_CSV = os.path.join(CROSSWALK_DIR, "puma2010-to-puma2020.csv")
+PUMA22_TO_COUNTY_CSV = os.path.join(CROSSWALK_DIR, "PUMA_2022_to_County_2020.csv")
+
+
+def puma_key(state, puma):
+    """7-digit state+PUMA code, e.g. ('1', '100') -> '0100100'.
+
+    This is the tail of the ACS GEO_ID ('7950000US0100100', '795P200US0100100').
+    """
+    state = pd.Series(state).astype(str).str.strip().str.zfill(2)
+    puma = pd.Series(puma).astype(str).str.strip().str.zfill(5)
+    return (state.values + puma.values).astype(object)
+
+
+def geo_id_to_key(geo_id):
+    """Strip the summary-level prefix from ACS GEO_IDs ('...US0100100' -> '0100100')."""
+    return pd.Series(geo_id).astype(str).str.split("US").str[-1].values.astype(object)
+
+
+# Summary-level prefix of the GEO_IDs each panel level is keyed by
+LEVEL_PREFIXES = {"puma": "7950000", "county": "0500000"}
+
+
+def level_key(geo, level):
+    """Panel key of a GEO_ID or bare code at `level` ('0500000US24510' or '24510' -> '24510').
+
+    Raises ValueError for a GEO_ID of another summary level or vintage, e.g. a
+    2022 PUMA ('795P200US...') asked for at the PUMA12 level.
+    """
+    geo = str(geo).strip()
+    prefix, sep, code = geo.rpartition("US")
+    if sep and prefix != LEVEL_PREFIXES[level]:
+        raise ValueError(f"{geo!r} is not a {level} GEO_ID "
+                         f"(expected {LEVEL_PREFIXES[level]}US...)")
+    return code.zfill(5) if level == "county" else code
+
+
+def _read_crosswalk_csv(csv_path):
+    # One process asks for the same file several times (counties, names,
+    # centroids); it is parsed once per version of the file on disk
+    st = os.stat(csv_path)
+    return _parse_crosswalk_csv(os.path.abspath(csv_path), st.st_mtime_ns, st.st_size).copy()
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_crosswalk_csv(csv_path, mtime_ns, size):
+    # Row 2 of the Geocorr exports holds the long column labels
+    df = pd.read_csv(csv_path, skiprows=[1], dtype=str, encoding="latin-1")
+    return df.apply(lambda col: col.str.strip())
+
+
+class Crosswalk:
+    """Sparse allocation matrix from one set of geographies to another.
+
+    `matrix` is (n_target x n_source): a source column vector of additive
+    values (household counts, not means or medians) is reallocated with
+    `matrix @ values`.
+    """
+
+    def __init__(self, source, target, matrix, name=""):
+        # scipy.sparse is slow to import; only building or applying a crosswalk needs it
+        from scipy import sparse
+
+        self.source = pd.Index(source, name="source")
+        self.target = pd.Index(target, name="target")
+        self.matrix = sparse.csr_matrix(matrix)
+        self.name = name
+
+    def __repr__(self):
+        return (f"Crosswalk({self.name!r}, {len(self.source)} sources -> "
+                f"{len(self.target)} targets, nnz={self.matrix.nnz})")
+
+    @classmethod
+    def from_pairs(cls, source, target, factor, name=""):
+        """Build from parallel arrays of (source code, target code, allocation factor)."""
+        from scipy import sparse
+
+        src_codes, src_index = pd.factorize(pd.Series(source), sort=True)
+        tgt_codes, tgt_index = pd.factorize(pd.Series(target), sort=True)
+        matrix = sparse.coo_matrix(
+            (np.asarray(factor, dtype="float64"), (tgt_codes, src_codes)),
+            shape=(len(tgt_index), len(src_index)),
+        )
+        # Duplicate pairs are summed when converting to CSR
+        return cls(src_index, tgt_index, matrix.tocsr(), name=name)
+
+    def then(self, other):
+        """Compose self (A -> B) with other (B -> C) into a single A -> C crosswalk."""
+        from scipy import sparse
+
+        # Line up our targets with the other crosswalk's sources; codes missing
+        # from either side simply drop out of the product
+        pos = other.source.get_indexer(self.target)
+        keep = pos >= 0
+        align = sparse.csr_matrix(
+            (np.ones(keep.sum()), (pos[keep], np.flatnonzero(keep))),
+            shape=(len(other.source), len(self.target)),
+        )
+        matrix = other.matrix @ align @ self.matrix
+        matrix.eliminate_zeros()
+        name = ""
+        if self.name and other.name:
+            name = f"{self.name.split('->')[0]}->{other.name.split('->')[-1]}"
+        return Crosswalk(self.source, other.target, matrix, name=name)
+
+    def align(self, keys):
+        """Matrix that maps values ordered by `keys` onto this crosswalk's sources."""
+        from scipy import sparse
+
+        pos = self.source.get_indexer(pd.Index(keys))
+        keep = pos >= 0
+        return sparse.csr_matrix(
+            (np.ones(keep.sum()), (pos[keep], np.flatnonzero(keep))),
+            shape=(len(self.source), len(keys)),
+        )
+
+    def apply(self, values, keys=None):
+        """Reallocate a (source x k) array in one sparse product.
+
+        If `keys` is given the rows of `values` are in that order (e.g. the
+        GEO_ID order of a panel) rather than in `self.source` order; rows whose
+        key is not in the crosswalk are dropped.
+        """
+        values = np.asarray(values, dtype="float64")
+        if keys is not None:
+            values = self.align(keys) @ values
+        return self.matrix @ values
+
+    def allocate(self, df, columns, key_col=None):
+        """Reallocate the numeric `columns` of a frame to the target geography.
+
+        Rows are matched on `key_col` (or the index). Returns a frame indexed by
+        target code with the same columns.
+        """
+        keys = df.index if key_col is None else df[key_col]
+        out = self.apply(df[list(columns)].to_numpy(dtype="float64"), keys=keys)
+        return pd.DataFrame(out, index=self.target, columns=list(columns))
+
+
+def load_puma12_to_puma22(csv_path=PUMA12_TO_PUMA22_CSV):
+    """PUMA 2012 -> PUMA 2022 using `afact` (share of the 2012 PUMA in each 2022 PUMA)."""
+    df = _read_crosswalk_csv(csv_path)
+    df = df[df["puma12"] != ""]
+    return Crosswalk.from_pairs(puma_key(df["state"], df["puma12"]),
+                                puma_key(df["state"], df["puma22"]),
+                                pd.to_numeric(df["afact"]).values,
+                                name="puma12->puma22")
+
+
+def load_puma22_to_puma12(csv_path=PUMA12_TO_PUMA22_CSV):
+    """PUMA 2022 -> PUMA 2012 using `AFACT2`."""
+    df = _read_crosswalk_csv(csv_path)
+    df = df[df["puma12"] != ""]
+    return Crosswalk.from_pairs(puma_key(df["state"], df["puma22"]),
+                                puma_key(df["state"], df["puma12"]),
+                                pd.to_numeric(df["AFACT2"]).values,
+                                name="puma22->puma12")
+
+
+def load_puma22_to_county(csv_path=PUMA22_TO_COUNTY_CSV):
+    """PUMA 2022 -> 2020 county (5-digit FIPS) using `afact`."""
+    df = _read_crosswalk_csv(csv_path)
+    return Crosswalk.from_pairs(puma_key(df["state"], df["puma22"]),
+                                df["county"].str.zfill(5).values,
+                                pd.to_numeric(df["afact"]).values,
+                                name="puma22->county")
+
+
+def load_puma12_to_county():
+    """PUMA 2012 -> county, composed through PUMA 2022 into one matrix."""
+    return load_puma12_to_puma22().then(load_puma22_to_county())
+
+
+def allocate_panel(panel, crosswalk, years, value="Household_ct", geo_col="GEO_ID"):
+    """Reallocate a wide panel (one '<value>_<year>' column per year) in one product.
+
+    `panel` is the output of ingest.build_wide (or 2010-2023_wide_v2.csv).
+    The 2012 and 2022 PUMA vintages sit on separate GEO_ID rows, so missing
+    values are treated as 0 when they collapse onto the same code; pick the
+    crosswalk that matches the vintage of `years`.
+    """
+    columns = [f"{value}_{yr}" for yr in years]
+    keys = geo_id_to_key(panel[geo_col])
+    values = np.nan_to_num(panel[columns].to_numpy(dtype="float64"))
+    with span("crosswalk.allocate", crosswalk=crosswalk.name, years=len(years)):
+        out = crosswalk.apply(values, keys=keys)
+    return pd.DataFrame(out, index=crosswalk.target, columns=columns)
+
+
+def county_centroids(csv_path=PUMA22_TO_COUNTY_CSV):
+    """Population-weighted county centroids (lat/lon) from the PUMA22 -> county pieces."""
+    df = _read_crosswalk_csv(csv_path)
+    pop = pd.to_numeric(df["pop20"])
+    lat = pd.to_numeric(df["IntPtLat"]) * pop
+    lon = pd.to_numeric(df["IntPtLon"]) * pop
+    county = df["county"].str.zfill(5)
+    sums = pd.DataFrame({"lat": lat, "lon": lon, "pop": pop}).groupby(county.values).sum()
+    out = pd.DataFrame({"IntPtLat": sums["lat"] / sums["pop"],
+                        "IntPtLon": sums["lon"] / sums["pop"]})
+    out.index.name = "county"
+    return out
+
+
+def county_info(csv_path=PUMA22_TO_COUNTY_CSV):
+    """County FIPS -> name ('Colbert AL') and state abbreviation."""
+    df = _read_crosswalk_csv(csv_path).drop_duplicates("county")
+    out = df[["CountyName", "stab"]].set_axis(df["county"].str.zfill(5).values)
+    out.index.name = "county"
+    return out
+
+
+def puma12_info(csv_path=PUMA12_TO_PUMA22_CSV):
+    """PUMA12 key -> PUMA12 name and state abbreviation, whatever the survey year."""
+    df = _read_crosswalk_csv(csv_path)
+    df = df[df["puma12"].notna() & (df["puma12"] != "")]
+    keys = puma_key(df["state"], df["puma12"])
+    out = (pd.DataFrame({"name": df["PUMA12name"].values, "stab": df["stab"].values}, index=keys)
+           .groupby(level=0).first())
+    out.index.name = "puma12"
+    return out
+
+
+def state_abbr(csv_path=PUMA22_TO_COUNTY_CSV):
+    """2-digit state FIPS -> postal abbreviation ('01' -> 'AL')."""
+    df = _read_crosswalk_csv(csv_path).drop_duplicates("state")
+    return pd.Series(df["stab"].values, index=df["state"].str.zfill(2).values, name="stab")
+
+
+def puma_to_county_for_year(yr):
+    """The PUMA -> county crosswalk matching a survey year's PUMA vintage.
+
+    2012-2021 releases use the 2012 PUMAs, 2022 onwards the 2022 PUMAs;
+    2010-2011 (2000 PUMAs) are not covered by the crosswalk files.
+    """
+    if yr >= 2022:
+        return load_puma22_to_county()
+    if yr >= 2012:
+        return load_puma12_to_county()
+    raise ValueError(f"No PUMA -> county crosswalk for {yr} (2000 PUMA vintage)")
+
+
+def puma12_panel(panel, years, value="Household_ct", geo_col="GEO_ID"):
+    """PUMA12 x year frame: 2012-2021 as published, 2022 onwards via AFACT2.
+
+    Rows are the PUMA12 codes of the crosswalk, so 2000-vintage and
+    2022-only codes in the panel never show up as empty rows.
+    """
+    xwalk = load_puma22_to_puma12()
+    keys = geo_id_to_key(panel[geo_col])
+    cols = []
+    early = [yr for yr in years if yr < 2022]
+    if early:
+        columns = [f"{value}_{yr}" for yr in early]
+        # 2022-vintage rows share the 7-digit code but are NaN in these years
+        cols.append(panel[columns].groupby(keys).sum(min_count=1).reindex(xwalk.target))
+    late = [yr for yr in years if yr >= 2022]
+    if late:
+        cols.append(allocate_panel(panel, xwalk, late, value=value, geo_col=geo_col))
+    out = pd.concat(cols, axis=1)
+    out.index.name = "puma12"
+    return out
+
+
+def county_panel(panel, years, value="Household_ct", geo_col="GEO_ID"):
+    """County x year frame from a wide PUMA panel, each year through its own vintage."""
+    cache = {}
+    cols = []
+    for yr in years:
+        vintage = 2022 if yr >= 2022 else 2012
+        if vintage not in cache:
+            cache[vintage] = puma_to_county_for_year(yr)
+        cols.append(allocate_panel(panel, cache[vintage], [yr], value=value, geo_col=geo_col))
+    return pd.concat(cols, axis=1)
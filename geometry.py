@@ -0,0 +1,216 @@
+"""Crosswalks built from boundary files and population-weighted points.
+
+    python geometry.py blocks.csv tract:GEOID:11 tl_2022_us_puma20.shp:GEOID20 -o tract_puma22.csv
+    python geometry.py blocks.csv tl_2020_us_zcta520.shp:ZCTA5CE20 county:GEOID:5 -o zcta_county.csv
+
+A crosswalk is made from points that carry a population (census block or
+block-group internal points, e.g. INTPTLAT/INTPTLON/POP20): every point is
+given a source and a target code, and the allocation factor of a
+(source, target) pair is the share of the source's population whose points
+fall in the target, the same `afact` the Geocorr files hold. A code comes
+either from a points column (optionally its first n characters, so block
+GEOIDs give tracts with GEOID:11 and counties with GEOID:5) or from a
+boundary file, by point-in-polygon:
+
+    puma = read_boundaries("tl_2022_us_puma20.shp", "GEOID20")
+    blocks = read_points("blocks.csv", "GEOID")
+    pts = blocks.assign(puma22=assign_points(blocks["INTPTLON"], blocks["INTPTLAT"], puma),
+                        tract=blocks["GEOID"].str[:11])
+    xwalk = point_crosswalk(pts["tract"], pts["puma22"], pts["POP20"], name="tract->puma22")
+
+assign_points() bulk-queries a shapely STRtree of the polygons with all the
+points of a chunk at once (no per-point Python loop); chunks are spread
+over a process pool that builds the tree once per worker. geopandas is only
+needed to read the boundary files.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from crosswalk import Crosswalk
+from instrument import span
+
+# Block-level point columns in the Census TIGER/Line and PL 94-171 files
+POINT_COLUMNS = {"lat": "INTPTLAT", "lon": "INTPTLON", "weight": "POP20"}
+
+# Points are assigned in chunks of this many rows, which bounds memory
+CHUNK_SIZE = 500_000
+
+# Per-process polygon tree, set up by _init_worker
+_TREE = {}
+
+
+def read_boundaries(path, id_col, layer=None):
+    """Polygons of a boundary file (shapefile, GeoPackage, GeoJSON) as a Series indexed by code.
+
+    Geometries are brought to lon/lat (EPSG:4326) unless they are already
+    in NAD83 or WGS84 degrees, which line up with the points' coordinates.
+    """
+    import geopandas as gpd
+
+    with span("geometry.read_boundaries", file=os.path.basename(path)):
+        gdf = gpd.read_file(path, layer=layer)
+    if gdf.crs is not None and gdf.crs.to_epsg() not in (4326, 4269):
+        gdf = gdf.to_crs(4326)
+    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notna()]
+    return pd.Series(gdf.geometry.to_numpy(), index=gdf[id_col].astype(str).str.strip().values,
+                     name="geometry")
+
+
+def read_points(csv_path, id_col="GEOID", lat=POINT_COLUMNS["lat"], lon=POINT_COLUMNS["lon"],
+                weight=POINT_COLUMNS["weight"]):
+    """Weighted points from a csv, keeping the code column as text (leading zeros matter)."""
+    df = pd.read_csv(csv_path, dtype={id_col: str}, usecols=[id_col, lat, lon, weight])
+    for col in (lat, lon, weight):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def _init_worker(polygons, max_distance):
+    import shapely
+
+    _TREE["tree"] = shapely.STRtree(polygons)
+    _TREE["max_distance"] = max_distance
+
+
+def _assign_chunk(chunk):
+    """Position of the polygon holding each point of a chunk, -1 where none does."""
+    import shapely
+
+    lon, lat = chunk
+    tree = _TREE["tree"]
+    pts = shapely.points(lon, lat)
+    out = np.full(len(pts), -1, dtype=np.int64)
+    pt_idx, poly_idx = tree.query(pts, predicate="intersects")
+    # A point on a shared edge is in both polygons; the first one wins
+    first = np.unique(pt_idx, return_index=True)[1]
+    out[pt_idx[first]] = poly_idx[first]
+
+    # Points just outside simplified boundaries (coastlines) go to the nearest polygon
+    if _TREE["max_distance"]:
+        miss = np.flatnonzero((out < 0) & ~np.isnan(lon + lat))
+        if len(miss):
+            near_pt, near_poly = tree.query_nearest(pts[miss], max_distance=_TREE["max_distance"],
+                                                    all_matches=False)
+            out[miss[near_pt]] = near_poly
+    return out
+
+
+def assign_points(lon, lat, polygons, max_distance=0.01, chunksize=CHUNK_SIZE, workers=1):
+    """Code of the polygon containing each point (lon/lat degrees), or None.
+
+    `polygons` is a Series of shapely geometries indexed by code, as from
+    read_boundaries(). Points outside every polygon but within
+    `max_distance` degrees of one are snapped to the nearest (0 turns this
+    off). workers > 1 spreads the chunks over a process pool.
+    """
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    geoms = np.asarray(polygons.to_numpy(), dtype=object)
+    chunks = [(lon[i:i + chunksize], lat[i:i + chunksize])
+              for i in range(0, len(lon), chunksize)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks) or 1))
+
+    with span("geometry.assign_points", points=len(lon), polygons=len(geoms), workers=workers):
+        if workers == 1:
+            _init_worker(geoms, max_distance)
+            try:
+                pos = [_assign_chunk(chunk) for chunk in chunks]
+            finally:
+                _TREE.clear()
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(geoms, max_distance)) as pool:
+                pos = list(pool.map(_assign_chunk, chunks))
+
+    pos = np.concatenate(pos) if pos else np.empty(0, dtype=np.int64)
+    codes = np.asarray(polygons.index, dtype=object)
+    return np.where(pos >= 0, codes[np.maximum(pos, 0)], None)
+
+
+def point_crosswalk(source, target, weight=None, name=""):
+    """Crosswalk from the source and target code of every point.
+
+    The factor of a pair is the source's weight (population) in the target
+    divided by its total weight. Points missing either code are left out.
+    A source whose points all have zero weight (an unpopulated tract) is
+    split by its number of points instead, so it still appears.
+    """
+    df = pd.DataFrame({"source": np.asarray(source, dtype=object),
+                       "target": np.asarray(target, dtype=object),
+                       "weight": 1.0 if weight is None else np.asarray(weight, dtype="float64")})
+    df = df[df["source"].notna() & df["target"].notna()]
+    df["weight"] = df["weight"].fillna(0).clip(lower=0)
+    df["points"] = 1.0
+    pairs = df.groupby(["source", "target"], sort=False)[["weight", "points"]].sum()
+    totals = pairs.groupby(level="source").transform("sum")
+    unweighted = totals["weight"] == 0
+    afact = np.where(unweighted, pairs["points"] / totals["points"],
+                     pairs["weight"] / totals["weight"].where(~unweighted, 1))
+    return Crosswalk.from_pairs(pairs.index.get_level_values("source"),
+                                pairs.index.get_level_values("target"), afact, name=name)
+
+
+def crosswalk_frame(xwalk):
+    """Long (source, target, afact) frame of a crosswalk, e.g. to save as csv."""
+    coo = xwalk.matrix.tocoo()
+    return (pd.DataFrame({"source": xwalk.source[coo.col], "target": xwalk.target[coo.row],
+                          "afact": coo.data})
+            .sort_values(["source", "target"], ignore_index=True))
+
+
+def read_crosswalk(csv_path, name=""):
+    """Load a crosswalk csv written by this module (source, target, afact)."""
+    df = pd.read_csv(csv_path, dtype={"source": str, "target": str})
+    return Crosswalk.from_pairs(df["source"].values, df["target"].values, df["afact"].values,
+                                name=name or os.path.splitext(os.path.basename(csv_path))[0])
+
+
+def _codes(spec, points, lon, lat, workers):
+    """(name, codes) for a '<boundary file>:<id column>' or '<name>:<column>[:<n chars>]' spec."""
+    # rpartition keeps Windows drive letters ('C:\\...') in the path
+    path, _, id_col = spec.rpartition(":")
+    stem, ext = os.path.splitext(os.path.basename(path))
+    if ext.lower() in (".shp", ".gpkg", ".geojson", ".json", ".zip"):
+        return stem, assign_points(points[lon], points[lat], read_boundaries(path, id_col),
+                                   workers=workers)
+    parts = spec.split(":")
+    if len(parts) not in (2, 3) or parts[1] not in points.columns:
+        raise SystemExit(f"{spec!r} is neither '<file>:<id column>' nor "
+                         f"'<name>:<points column>[:n]'")
+    codes = points[parts[1]].astype(str).str.strip()
+    if len(parts) == 3:
+        codes = codes.str[:int(parts[2])]
+    return parts[0], codes.to_numpy(dtype=object)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build a crosswalk from weighted points and boundary files")
+    parser.add_argument("points", help="csv of points, e.g. census block internal points")
+    parser.add_argument("source",
+                        help="'<file>.shp:<id column>' or '<name>:<points column>[:n chars]'")
+    parser.add_argument("target", help="same form as source")
+    parser.add_argument("-o", "--out", required=True, help="output csv (source, target, afact)")
+    parser.add_argument("--id", default="GEOID", help="code column of the points")
+    parser.add_argument("--lat", default=POINT_COLUMNS["lat"])
+    parser.add_argument("--lon", default=POINT_COLUMNS["lon"])
+    parser.add_argument("--weight", default=POINT_COLUMNS["weight"])
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+
+    points = read_points(args.points, args.id, args.lat, args.lon, args.weight)
+    src_name, src = _codes(args.source, points, args.lon, args.lat, args.workers)
+    tgt_name, tgt = _codes(args.target, points, args.lon, args.lat, args.workers)
+    xwalk = point_crosswalk(src, tgt, points[args.weight], name=f"{src_name}->{tgt_name}")
+    crosswalk_frame(xwalk).to_csv(args.out, index=False)
+    print(f"[geometry] {xwalk} from {len(points)} points written to {args.out}; "
+          f"{int(pd.isna(src).sum())} source / {int(pd.isna(tgt).sum())} target codes missing")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Income-distribution statistics from the S1901 household income brackets.
+
+S1901_C01_002E ... S1901_C01_011E are the percent of households in ten
+income brackets. Multiplied by the household count they become counts per
+bracket, which (unlike medians or shares) can be summed, reallocated
+through a crosswalk or rolled up; the statistics are then interpolated from
+the counts for every geography and year at once:
+
+    counts = bracket_counts(shares, households)      # [geo, year, bracket]
+    med = median(counts)                             # [geo, year]
+    p = percentiles(counts, [0.1, 0.9])              # [geo, year, 2]
+    rich = share_above(counts, 100_000)              # percent of households
+    county_counts = allocate_brackets(xwalk, counts, keys)
+
+Within a bracket households are assumed to be spread evenly. ACS computes
+its published medians from finer brackets than these ten, so the results
+are approximations: against S1901_C01_012E for the PUMAs (2012, 2019, 2023)
+the interpolated median is off by about 1.2% for the typical PUMA, 4.5% at
+the 95th percentile of PUMAs and up to 10% in the worst case. The top
+bracket is open ended, so a percentile that falls in it is reported at its
+lower edge, $200,000. That is a floor, not the ACS top-code (published
+medians are top-coded at "250,000+"), and high percentiles such as p99 come
+out low wherever they reach the top bracket.
+"""
+import numpy as np
+import pandas as pd
+
+BRACKET_COLUMNS = [f"S1901_C01_{i:03d}E" for i in range(2, 12)]
+HOUSEHOLD_COLUMN = "S1901_C01_001E"
+
+# Lower edge of each bracket; the last one is open ended
+BRACKET_EDGES = np.array([0, 10_000, 15_000, 25_000, 35_000, 50_000,
+                          75_000, 100_000, 150_000, 200_000, np.inf])
+TOP_CODE = BRACKET_EDGES[-2]
+
+
+def bracket_counts(shares, households):
+    """Households per bracket from percent shares [..., bracket] and totals [...]."""
+    shares = np.asarray(shares, dtype="float64")
+    households = np.asarray(households, dtype="float64")
+    return shares * households[..., None] / 100
+
+
+def store_counts(store, years=None):
+    """[geo, year, bracket] counts from a PanelStore holding the S1901 columns."""
+    j = slice(None) if years is None else [store.year_pos(yr) for yr in years]
+    pos = [store.var_pos(c) for c in BRACKET_COLUMNS]
+    return bracket_counts(store.values[:, j][:, :, pos], store.view(HOUSEHOLD_COLUMN)[:, j])
+
+
+def percentiles(counts, q):
+    """Interpolated income percentiles for every row at once.
+
+    `counts` is [..., bracket] and `q` a scalar or sequence of fractions in
+    [0, 1]. Returns [..., len(q)] (or [...] for a scalar q); NaN where a row
+    has no households or any missing bracket.
+    """
+    counts = np.asarray(counts, dtype="float64")
+    scalar = np.ndim(q) == 0
+    q = np.atleast_1d(np.asarray(q, dtype="float64"))
+    if ((q < 0) | (q > 1)).any():
+        raise ValueError("percentiles must be fractions between 0 and 1")
+
+    cum = np.cumsum(counts, axis=-1)
+    total = cum[..., -1]
+    target = total[..., None] * q                                       # [..., q]
+    # First bracket whose cumulative count reaches the target
+    idx = (cum[..., None, :] < target[..., None]).sum(axis=-1)          # [..., q]
+    idx = np.minimum(idx, counts.shape[-1] - 1)
+    below = np.take_along_axis(np.concatenate([np.zeros_like(cum[..., :1]), cum], axis=-1),
+                               idx, axis=-1)
+    in_bracket = np.take_along_axis(counts, idx, axis=-1)
+    lo, hi = BRACKET_EDGES[idx], BRACKET_EDGES[idx + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.clip(np.where(in_bracket > 0, (target - below) / in_bracket, 0), 0, 1)
+        out = np.where(np.isinf(hi), lo, lo + frac * (hi - lo))
+    out = np.where((total[..., None] > 0) & ~np.isnan(total[..., None]), out, np.nan)
+    return out[..., 0] if scalar else out
+
+
+def median(counts):
+    """Interpolated median household income, [...] for counts [..., bracket]."""
+    return percentiles(counts, 0.5)
+
+
+def share_above(counts, threshold):
+    """Percent of households with income at or above `threshold`.
+
+    Thresholds above the $200,000 top bracket edge cannot be answered from
+    the brackets and raise ValueError.
+    """
+    if threshold > TOP_CODE:
+        raise ValueError(f"threshold must be at most {TOP_CODE:,.0f}, the top bracket edge")
+    counts = np.asarray(counts, dtype="float64")
+    lo, hi = BRACKET_EDGES[:-1], BRACKET_EDGES[1:]
+    with np.errstate(invalid="ignore"):
+        part = np.where(np.isinf(hi), lo >= threshold,
+                        np.clip((hi - threshold) / (hi - lo), 0, 1))
+    total = counts.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, 100 * (counts * part).sum(axis=-1) / total, np.nan)
+
+
+def allocate_brackets(crosswalk, counts, keys=None):
+    """Reallocate [geo, year, bracket] counts through a crosswalk in one product.
+
+    Rows follow `keys` (or the crosswalk's sources). Missing counts are
+    treated as 0, so statistics of a target are taken over the pieces that
+    reported.
+    """
+    counts = np.asarray(counts, dtype="float64")
+    flat = np.nan_to_num(counts.reshape(len(counts), -1))
+    out = crosswalk.apply(flat, keys=keys)
+    return out.reshape((out.shape[0],) + counts.shape[1:])
+
+
+def income_frame(counts, years, index=None, q=(0.25, 0.5, 0.75), thresholds=(100_000,)):
+    """Wide frame of distribution statistics for [geo, year, bracket] counts.
+
+    Columns follow the panel naming, e.g. 'Median_Income_2019',
+    'P25_Income_2019' and 'Share_100k_plus_2019'.
+    """
+    counts = np.asarray(counts, dtype="float64")
+    pct = percentiles(counts, q)
+    cols = {}
+    for j, yr in enumerate(years):
+        for k, frac in enumerate(q):
+            name = "Median_Income" if frac == 0.5 else f"P{frac * 100:g}_Income"
+            cols[f"{name}_{yr}"] = pct[:, j, k]
+        for thr in thresholds:
+            cols[f"Share_{thr / 1000:g}k_plus_{yr}"] = share_above(counts[:, j], thr)
+    return pd.DataFrame(cols, index=index)
@@ -0,0 +1,313 @@
+import hashlib
+import os
+import re
+
+import pandas as pd
+
+from instrument import span
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DIR = os.path.join(BASE_DIR, "Raw Data")
+
+# Bump this when the conversion below changes so old cache files are ignored
+CACHE_VERSION = 2
+
+# Census placeholders for suppressed / not applicable values
+ACS_NA_VALUES = ["N", "(X)", "-", "**", "***", "*****", "null"]
+
+ID_COLS = ["GEO_ID", "NAME"]
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """Content hash (sha1) of a file, used as the cache key."""
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_numeric(col):
+    # Top-coded values such as "250,000+" are kept at the top-code. Text columns
+    # are object or (pandas 3) str dtype, so test for "not numeric" rather than object
+    if not pd.api.types.is_numeric_dtype(col):
+        col = col.str.replace(",", "", regex=False).str.rstrip("+")
+    return pd.to_numeric(col, errors="coerce").astype("float64")
+
+
+def parse_acs_csv(csv_path):
+    """Parse a raw ACS table export into a typed frame.
+
+    The second line of the export is the column annotation row; it is skipped
+    so that every estimate / MOE column comes out as float64.
+    """
+    df = pd.read_csv(csv_path, header=0, skiprows=[1],
+                     dtype={"GEO_ID": str, "NAME": str},
+                     na_values=ACS_NA_VALUES, keep_default_na=True)
+    num_cols = [c for c in df.columns if c not in ID_COLS]
+    df[num_cols] = df[num_cols].apply(_to_numeric)
+    return df
+
+
+def cache_path_for(csv_path, cache_dir=None):
+    # By default the cache sits in a .cache folder next to the csv
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_path)), ".cache")
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    digest = file_hash(csv_path)[:16]
+    return os.path.join(cache_dir, f"{name}-v{CACHE_VERSION}-{digest}.parquet")
+
+
+def read_acs_csv(csv_path, columns=None, cache_dir=None):
+    """Read a raw ACS csv through the columnar cache.
+
+    The first call converts the whole file to Parquet; later calls only read
+    the requested `columns` back from the Parquet file. Editing the csv
+    changes its hash, so a stale cache is never returned.
+    """
+    cached = cache_path_for(csv_path, cache_dir)
+    cache_dir = os.path.dirname(cached)
+    if not os.path.exists(cached):
+        os.makedirs(cache_dir, exist_ok=True)
+        with span("ingest.parse_csv", file=os.path.basename(csv_path)):
+            df = parse_acs_csv(csv_path)
+        # Drop older cache files for the same source
+        prefix = os.path.splitext(os.path.basename(csv_path))[0] + "-v"
+        for old in os.listdir(cache_dir):
+            if old.startswith(prefix) and old.endswith(".parquet"):
+                os.remove(os.path.join(cache_dir, old))
+        tmp = cached + ".tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, cached)
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+    with span("ingest.read_cache", file=os.path.basename(csv_path)):
+        return pd.read_parquet(cached, columns=None if columns is None else list(columns))
+
+
+def read_year(year, columns=None, raw_dir=RAW_DIR, cache_dir=None):
+    return read_acs_csv(os.path.join(raw_dir, f"{year}.csv"), columns=columns,
+                        cache_dir=cache_dir)
+
+
+# List of years with CSV files (note 2020 is missing)
+YEARS = [2010, 2011, 2012, 2013, 2014, 2015, 2016,
+         2017, 2018, 2019, 2021, 2022, 2023]
+
+
+def available_years(raw_dir=RAW_DIR):
+    """Years with a '<year>.csv' release in `raw_dir`, so a new one is picked up when dropped in."""
+    return sorted(int(name[:4]) for name in os.listdir(raw_dir)
+                  if re.fullmatch(r"\d{4}\.csv", name))
+
+# Wide output columns, in the same naming used by 2010-2023_wide_v2.csv
+WIDE_VALUES = {
+    "NAME": "NAME",
+    "S1901_C01_001E": "Household_ct",
+    "S1901_C01_013E": "Mean_Income",
+}
+
+
+def moe_column(col):
+    """MOE column paired with an estimate column ('S1901_C01_001E' -> 'S1901_C01_001M')."""
+    return col[:-1] + "M"
+
+
+def with_moe(columns):
+    """`columns` with each estimate's MOE column inserted right after it."""
+    out = []
+    for col in columns:
+        out.append(col)
+        if col.startswith("S") and col.endswith("E"):
+            out.append(moe_column(col))
+    return out
+
+
+def load_years(years=YEARS, columns=None, raw_dir=RAW_DIR, cache_dir=None,
+               max_workers=None):
+    """Read several years concurrently, returning {year: frame}.
+
+    CSV and Parquet parsing release the GIL, so a thread pool is enough and
+    avoids pickling frames back from worker processes.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    years = list(years)
+    if max_workers is None:
+        max_workers = min(len(years), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = pool.map(lambda yr: read_year(yr, columns=columns, raw_dir=raw_dir,
+                                               cache_dir=cache_dir), years)
+        return dict(zip(years, frames))
+
+
+def build_long(years=YEARS, columns=None, raw_dir=RAW_DIR, cache_dir=None,
+               max_workers=None):
+    """Stack every year into one long panel with a 'Year' column."""
+    frames = load_years(years, columns=columns, raw_dir=raw_dir,
+                        cache_dir=cache_dir, max_workers=max_workers)
+    return pd.concat([df.assign(Year=yr) for yr, df in frames.items()],
+                     ignore_index=True)
+
+
+# ---- streaming ingestion (tract / block-group scale) ----
+
+DATASET_DIR = os.path.join(RAW_DIR, "dataset")
+
+
+def state_of(geo_ids):
+    """Two-digit state FIPS from GEO_IDs ('1400000US06037101110' -> '06'); 'US' for the nation."""
+    state = geo_ids.str.split("US", n=1).str[-1].str[:2]
+    return state.where(state.str.len() == 2, "US")
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    return pa.schema([(c, pa.string() if c in ID_COLS else pa.float64()) for c in columns])
+
+
+def stream_year(year, columns, raw_dir=RAW_DIR, dataset_dir=DATASET_DIR,
+                chunksize=100_000, force=False):
+    """Stream one year's csv into `dataset_dir`/year=<year>/state=<fips>/.
+
+    The csv is read `chunksize` rows at a time and only `columns` are parsed,
+    so memory is bounded by one chunk whatever the file size. Each state gets
+    one Parquet file, with one row group per chunk. The year is written to a
+    temporary folder and swapped in at the end; it is skipped when the csv
+    and columns match the last run. Returns the number of rows written.
+    """
+    import json
+    import shutil
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    csv_path = os.path.join(raw_dir, f"{year}.csv")
+    if columns is None:
+        columns = list(pd.read_csv(csv_path, nrows=0).columns)
+    columns = [c for c in ID_COLS if c not in columns] + list(columns)
+    year_dir = os.path.join(dataset_dir, f"year={year}")
+    marker = os.path.join(year_dir, "_source.json")
+    source = {"sha1": file_hash(csv_path), "columns": columns, "version": CACHE_VERSION}
+    if not force and os.path.exists(marker):
+        with open(marker) as f:
+            done = json.load(f)
+        if {k: done.get(k) for k in source} == source:
+            return done["rows"]
+
+    # Leading underscore keeps a half-written year out of dataset discovery
+    tmp_dir = os.path.join(dataset_dir, f"_tmp-year={year}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    schema = _arrow_schema(columns)
+    writers = {}
+    rows = 0
+    reader = pd.read_csv(csv_path, header=0, skiprows=[1], usecols=columns,
+                         dtype={"GEO_ID": str, "NAME": str}, na_values=ACS_NA_VALUES,
+                         keep_default_na=True, chunksize=chunksize)
+    try:
+        with span("ingest.stream_year", year=year):
+            for chunk in reader:
+                num_cols = [c for c in columns if c not in ID_COLS]
+                chunk[num_cols] = chunk[num_cols].apply(_to_numeric)
+                chunk = chunk[columns]
+                for state, part in chunk.groupby(state_of(chunk["GEO_ID"]), sort=False):
+                    writer = writers.get(state)
+                    if writer is None:
+                        part_dir = os.path.join(tmp_dir, f"state={state}")
+                        os.makedirs(part_dir, exist_ok=True)
+                        writer = writers[state] = pq.ParquetWriter(
+                            os.path.join(part_dir, "part-0.parquet"), schema)
+                    writer.write_table(pa.Table.from_pandas(part, schema=schema,
+                                                            preserve_index=False))
+                rows += len(chunk)
+    finally:
+        reader.close()
+        for writer in writers.values():
+            writer.close()
+
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(os.path.join(tmp_dir, "_source.json"), "w") as f:
+        json.dump(dict(source, rows=rows), f, indent=1)
+    shutil.rmtree(year_dir, ignore_errors=True)
+    os.replace(tmp_dir, year_dir)
+    return rows
+
+
+def stream_years(years=YEARS, columns=None, raw_dir=RAW_DIR, dataset_dir=DATASET_DIR,
+                 chunksize=100_000, force=False):
+    """Stream several years into the partitioned dataset, one year at a time.
+
+    Years are done one after another on purpose: peak memory stays at one
+    chunk instead of growing with the number of years. Returns {year: rows}.
+    """
+    return {yr: stream_year(yr, columns, raw_dir=raw_dir, dataset_dir=dataset_dir,
+                            chunksize=chunksize, force=force)
+            for yr in years}
+
+
+def _open_dataset(dataset_dir):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([("year", pa.int64()), ("state", pa.string())]),
+                                   flavor="hive")
+    return ds.dataset(dataset_dir, format="parquet", partitioning=partitioning,
+                      exclude_invalid_files=True)
+
+
+def _dataset_filter(years=None, states=None):
+    import pyarrow.dataset as ds
+
+    expr = None
+    if years is not None:
+        expr = ds.field("year").isin(list(years))
+    if states is not None:
+        states = [states] if isinstance(states, str) else list(states)
+        cond = ds.field("state").isin(states)
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def _with_year(df):
+    return df.rename(columns={"year": "Year"}).drop(columns="state", errors="ignore")
+
+
+def iter_dataset(columns=None, years=None, states=None, dataset_dir=DATASET_DIR,
+                 batch_size=100_000):
+    """Yield the long panel as frames of at most `batch_size` rows.
+
+    Only the requested columns, years and states are read. Each frame has a
+    'Year' column, as in build_long.
+    """
+    dataset = _open_dataset(dataset_dir)
+    cols = None if columns is None else list(columns) + ["year"]
+    for batch in dataset.to_batches(columns=cols, filter=_dataset_filter(years, states),
+                                    batch_size=batch_size):
+        if batch.num_rows:
+            yield _with_year(batch.to_pandas())
+
+
+def read_dataset(columns=None, years=None, states=None, dataset_dir=DATASET_DIR):
+    """Load a slice of the partitioned dataset as one long frame with a 'Year' column."""
+    dataset = _open_dataset(dataset_dir)
+    cols = None if columns is None else list(columns) + ["year"]
+    table = dataset.to_table(columns=cols, filter=_dataset_filter(years, states))
+    return _with_year(table.to_pandas())
+
+
+def build_wide(df_long, values=WIDE_VALUES):
+    """Pivot the long panel to one row per GEO_ID in a single pass.
+
+    Replaces the chain of per-year outer merges; columns come out as
+    '<name>_<year>' grouped by year, e.g. NAME_2010, Household_ct_2010, ...
+    """
+    wide = df_long.pivot(index="GEO_ID", columns="Year", values=list(values))
+    years = list(wide.columns.get_level_values("Year").unique())
+    wide = wide[[(col, yr) for yr in years for col in values]]
+    wide.columns = [f"{values[col]}_{yr}" for col, yr in wide.columns]
+    wide = wide.reset_index()
+    # pivot upcasts mixed blocks to object; restore numeric columns
+    num_cols = [f"{values[c]}_{yr}" for yr in years for c in values if c not in ID_COLS]
+    wide[num_cols] = wide[num_cols].astype("float64")
+    return wide
@@ -0,0 +1,172 @@
+"""Named timing spans with optional peak-memory and cProfile capture.
+
+Off by default. Set HH_TRACE to a file path to record every span and write a
+Chrome trace-event JSON on exit (open it in https://ui.perfetto.dev or
+chrome://tracing for a flame chart):
+
+    HH_TRACE=trace.json python "Mapping out household counts.py"
+
+HH_TRACE_MEMORY=1 also records the peak traced memory of each span
+(tracemalloc, which slows Python code down noticeably), and HH_PROFILE=<dir>
+dumps a cProfile .prof file for every span opened with profile=True.
+When HH_TRACE is unset, span() returns a shared no-op context manager.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+TRACE_PATH = os.environ.get("HH_TRACE")
+TRACE_MEMORY = os.environ.get("HH_TRACE_MEMORY", "") not in ("", "0")
+PROFILE_DIR = os.environ.get("HH_PROFILE")
+
+ENABLED = bool(TRACE_PATH)
+
+_NULL = contextlib.nullcontext()
+_events = []
+_local = threading.local()
+_lock = threading.Lock()
+_profiling = [False]
+
+
+class _Span:
+    __slots__ = ("name", "args", "profile", "start", "peak", "profiler")
+
+    def __init__(self, name, args, profile):
+        self.name = name
+        self.args = args
+        self.profile = profile
+        self.peak = 0
+        self.profiler = None
+
+    def __enter__(self):
+        stack = _stack()
+        if TRACE_MEMORY:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # Fold the peak so far into the parent before resetting it for this span
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if self.profile and PROFILE_DIR:
+            with _lock:
+                if not _profiling[0]:
+                    import cProfile
+                    self.profiler = cProfile.Profile()
+                    _profiling[0] = True
+            if self.profiler is not None:
+                self.profiler.enable()
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        stack = _stack()
+        stack.pop()
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in self.name)
+            self.profiler.dump_stats(os.path.join(PROFILE_DIR, f"{safe}-{os.getpid()}.prof"))
+            _profiling[0] = False
+        args = dict(self.args)
+        if TRACE_MEMORY:
+            import tracemalloc
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            args["peak_mem_mb"] = round(self.peak / 2 ** 20, 3)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            tracemalloc.reset_peak()
+        event = {"name": self.name, "ph": "X", "ts": self.start / 1000,
+                 "dur": (end - self.start) / 1000, "pid": os.getpid(),
+                 "tid": threading.get_ident(), "args": args}
+        with _lock:
+            _events.append(event)
+        return False
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def span(name, profile=False, **args):
+    """Context manager timing one stage, e.g. span('render', year=2019)."""
+    if not ENABLED:
+        return _NULL
+    return _Span(name, args, profile)
+
+
+def traced(name=None, profile=False):
+    """Decorator form of span(); the span name defaults to the function's name."""
+    def wrap(func):
+        if not ENABLED:
+            return func
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def inner(*a, **kw):
+            with _Span(label, {}, profile):
+                return func(*a, **kw)
+        return inner
+    return wrap
+
+
+def events():
+    with _lock:
+        return list(_events)
+
+
+def write_trace(path=None):
+    """Write the recorded spans as Chrome trace-event JSON.
+
+    Worker processes write next to the main trace with their pid in the name,
+    so pool runs end up as one file per process.
+    """
+    path = path or TRACE_PATH
+    if not path:
+        return None
+    if os.getpid() != _MAIN_PID:
+        stem, ext = os.path.splitext(path)
+        path = f"{stem}.{os.getpid()}{ext or '.json'}"
+    data = {"traceEvents": events(), "displayTimeUnit": "ms"}
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+def _register_exit():
+    atexit.register(write_trace)
+    # Pool workers leave through multiprocessing's exit path, which skips atexit
+    from multiprocessing import util
+    util.Finalize(None, write_trace, exitpriority=0)
+
+
+def _after_fork(_):
+    # Forked workers start with their own, empty trace
+    global _lock
+    _lock = threading.Lock()
+    _events.clear()
+    _local.stack = []
+    _register_exit()
+
+
+_MAIN_PID = os.getpid()
+
+if ENABLED:
+    from multiprocessing import util as _mp_util
+
+    # Spawned workers re-import this module, so the main pid is passed down
+    # through the environment; it is only set when tracing is on
+    _MAIN_PID = int(os.environ.setdefault("HH_TRACE_MAIN_PID", str(_MAIN_PID)))
+    _register_exit()
+    # The registry holds its key object weakly; the module-level function
+    # lives as long as the module does
+    _mp_util.register_after_fork(_after_fork, _after_fork)
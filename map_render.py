@@ -0,0 +1,207 @@
+import os
+
+import numpy as np
+
+from instrument import span
+
+# Continental US, as used by every map in "Mapping out household counts.py"
+US_EXTENT = [-125, -66, 24.5, 50]
+
+# Per-process state, set up by _init_worker
+_POINTS = {}
+_FIGURE = {}
+
+
+def map_job(values, title, cbar_label, path, vmin, vmax, cmap="viridis",
+            tick_fmt="{x:,.0f}", dpi=300, key=None):
+    """One map to render: a color array for the shared points plus labels and an output path.
+
+    Jobs with the same `key` (e.g. the PNG and SVG of one year) share one
+    frame, so a worker that gets both only updates the map once.
+    """
+    return {
+        "values": values, "title": title, "cbar_label": cbar_label, "path": path,
+        "vmin": vmin, "vmax": vmax, "cmap": cmap, "tick_fmt": tick_fmt, "dpi": dpi,
+        "key": key if key is not None else os.path.splitext(path)[0],
+    }
+
+
+def year_jobs(values_by_year, title, cbar_label, path, formats=("png", "svg"), **kwargs):
+    """Expand per-year values into one job per (year, format).
+
+    `title`, `cbar_label` and `path` are callables of the year; `path` returns
+    the output path without extension.
+    """
+    jobs = []
+    for yr, values in values_by_year.items():
+        for fmt in formats:
+            jobs.append(map_job(values, title(yr), cbar_label(yr), f"{path(yr)}.{fmt}",
+                                key=(path(yr), yr), **kwargs))
+    return jobs
+
+
+def _init_worker(lon, lat, headless=True):
+    if headless:
+        import matplotlib
+        matplotlib.use("Agg")
+    _POINTS["lon"] = lon
+    _POINTS["lat"] = lat
+
+
+class BaseMap:
+    """Continental-US scatter map that is built once and re-colored per frame.
+
+    The figure, GeoAxes, coastline/state features, gridlines and colorbar are
+    created in __init__; `update` only swaps the scatter's color array and the
+    title/colorbar text, so each extra year costs a redraw rather than a new
+    figure. Frames for an animation reuse the same artists.
+    """
+
+    def __init__(self, lon, lat, vmin, vmax, cmap="viridis", tick_fmt="{x:,.0f}"):
+        with span("map.basemap"):
+            self._build(lon, lat, vmin, vmax, cmap, tick_fmt)
+
+    def _build(self, lon, lat, vmin, vmax, cmap, tick_fmt):
+        import matplotlib.pyplot as plt
+        import cartopy.crs as ccrs
+        import cartopy.feature as cfeature
+        from matplotlib.colors import Normalize
+        from matplotlib.ticker import FuncFormatter
+
+        # Create figure and cartopy projection
+        self.fig, self.ax = plt.subplots(figsize=(15, 10),
+                                         subplot_kw={'projection': ccrs.PlateCarree()})
+
+        # Set map extent for the continental US
+        self.ax.set_extent(US_EXTENT, crs=ccrs.PlateCarree())
+
+        # Add map context
+        self.ax.add_feature(cfeature.COASTLINE)
+        self.ax.add_feature(cfeature.STATES, edgecolor='gray', linewidth=0.5)
+
+        # Scatter with an empty color array; filled in by update()
+        self.scatter = self.ax.scatter(lon, lat, c=np.full(len(lon), np.nan), cmap=cmap,
+                                       norm=Normalize(vmin=vmin, vmax=vmax),
+                                       alpha=0.8, edgecolor='white', linewidth=0.5, s=100)
+
+        # Add colorbar; the norm is fixed so the tick labels never change
+        self.cbar = plt.colorbar(self.scatter, ax=self.ax, orientation='vertical',
+                                 shrink=0.7, pad=0.02)
+        self.cbar.ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: tick_fmt.format(x=x)))
+        self.cbar.set_label(" ", size=12)
+
+        # Title, axes, and grid
+        self.title = self.ax.set_title(" ", pad=20, size=14)
+        self.ax.set_xlabel('Longitude', size=12)
+        self.ax.set_ylabel('Latitude', size=12)
+        gl = self.ax.gridlines(draw_labels=True, linewidth=0.5, color='gray', alpha=0.5)
+        gl.top_labels = False
+        gl.right_labels = False
+
+        self.fig.tight_layout()
+
+    def update(self, values, title, cbar_label=None):
+        """Swap in a new year's values; returns the artists that changed."""
+        self.scatter.set_array(np.ma.masked_invalid(np.asarray(values, dtype="float64")))
+        self.title.set_text(title)
+        if cbar_label is not None:
+            self.cbar.set_label(cbar_label, size=12)
+        return [self.scatter, self.title, self.cbar.ax.yaxis.label]
+
+    def save(self, path, dpi=300):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with span("map.savefig", file=os.path.basename(path), dpi=dpi):
+            self.fig.savefig(path, dpi=dpi)
+        return path
+
+    def animate(self, frames, path, fps=2, dpi=100):
+        """Write a GIF/MP4 time-lapse from [(values, title, cbar_label), ...].
+
+        GIFs use Pillow, anything else ffmpeg. Only the scatter and text
+        artists are updated between frames.
+        """
+        from matplotlib import animation
+
+        frames = list(frames)
+        writer = (animation.PillowWriter(fps=fps) if path.lower().endswith(".gif")
+                  else animation.FFMpegWriter(fps=fps))
+        anim = animation.FuncAnimation(self.fig, lambda i: self.update(*frames[i]),
+                                       frames=len(frames), blit=False, repeat=False)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        anim.save(path, writer=writer, dpi=dpi)
+        return path
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close(self.fig)
+
+
+def _style(job):
+    return (job["vmin"], job["vmax"], job["cmap"], job["tick_fmt"])
+
+
+def render_job(job):
+    """Render and save one job inside a worker; returns the output path."""
+    # Each worker keeps one BaseMap per style and only re-colors it between jobs
+    if _FIGURE.get("style") != _style(job):
+        _close_worker_figure()
+        vmin, vmax, cmap, tick_fmt = _style(job)
+        _FIGURE["map"] = BaseMap(_POINTS["lon"], _POINTS["lat"], vmin, vmax, cmap, tick_fmt)
+        _FIGURE["style"] = _style(job)
+    with span("map.frame", title=job["title"]):
+        if _FIGURE.get("key") != job["key"]:
+            _FIGURE["map"].update(job["values"], job["title"], job["cbar_label"])
+            _FIGURE["key"] = job["key"]
+        return _FIGURE["map"].save(job["path"], dpi=job["dpi"])
+
+
+def render_animation(values_by_year, lon, lat, path, title, cbar_label, vmin, vmax,
+                     cmap="viridis", tick_fmt="{x:,.0f}", fps=2, dpi=100):
+    """Time-lapse (GIF/MP4) of the per-year maps, drawn on one BaseMap."""
+    base = BaseMap(np.asarray(lon, dtype="float64"), np.asarray(lat, dtype="float64"),
+                   vmin, vmax, cmap, tick_fmt)
+    try:
+        frames = [(values, title(yr), cbar_label(yr)) for yr, values in values_by_year.items()]
+        return base.animate(frames, path, fps=fps, dpi=dpi)
+    finally:
+        base.close()
+
+
+def render_maps(jobs, lon, lat, workers=None):
+    """Render map jobs across a process pool; returns the saved paths in job order.
+
+    `workers` defaults to the CPU count; workers=1 renders in this process.
+    """
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    jobs = list(jobs)
+    for job in jobs:
+        job["values"] = np.asarray(job["values"], dtype="float64")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    with span("map.render_maps", jobs=len(jobs), workers=workers):
+        if workers == 1:
+            _init_worker(lon, lat, headless=False)
+            try:
+                return [render_job(job) for job in jobs]
+            finally:
+                _close_worker_figure()
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(lon, lat)) as pool:
+            return list(pool.map(render_job, jobs, chunksize=_chunksize(jobs)))
+
+
+def _chunksize(jobs):
+    # One chunk per frame, so every format of a frame is saved from the same figure
+    return max(1, len(jobs) // max(1, len({job["key"] for job in jobs})))
+
+
+def _close_worker_figure():
+    if "map" in _FIGURE:
+        _FIGURE["map"].close()
+    _FIGURE.clear()
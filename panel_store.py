@@ -0,0 +1,271 @@
+"""On-disk geography x year x variable panel shared through memory maps.
+
+Estimates (and MOEs) live in float32 .npy files shaped [geo, year, variable]
+next to a meta.json holding the GEO_ID, year and variable axes:
+
+    store = PanelStore.from_frames("build/panel_store", {yr: df, ...},
+                                   {"S1901_C01_001E": "Household_ct"})
+    hh = store.view("Household_ct")          # [geo, year], no copy
+    hh_2019 = store.view("Household_ct", 2019)
+
+Opening a store maps the files instead of reading them, and pickling one only
+sends its path, so pool workers each reopen the same pages rather than
+receiving their own copy of the panel.
+
+On disk the arrays are [year, geo, variable], so a new release is added with
+
+    PanelStore.append_years("build/panel_store", {2024: df})
+
+by writing one block at the end of each file; `values` and `moes` are
+transposed views and always read as [geo, year, variable].
+"""
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from ingest import moe_column
+
+DTYPE = np.float32
+
+# On-disk axis order. Stores without "axes" in meta.json are [geo, year, variable]
+AXES = ["year", "geo", "variable"]
+
+
+def _year_block(df, geo, cols, geo_col="GEO_ID", moes=True):
+    """[geo, variable] estimates (and MOEs, or None) of one year's frame; NaN where absent."""
+    rows = geo.get_indexer(df[geo_col])
+    values = np.full((len(geo), len(cols)), np.nan, dtype=DTYPE)
+    values[rows] = df[cols].to_numpy(dtype=DTYPE)
+    if not moes:
+        return values, None
+    errors = np.full_like(values, np.nan)
+    moe_cols = [moe_column(c) for c in cols]
+    have = [k for k, c in enumerate(moe_cols) if c in df.columns]
+    if have:
+        errors[rows[:, None], have] = df[[moe_cols[k] for k in have]].to_numpy(dtype=DTYPE)
+    return values, errors
+
+
+def _grow_npy(path, n_rows, blocks):
+    """Write `blocks` as rows n_rows, n_rows + 1, ... of a .npy file's first axis, in place.
+
+    Only the blocks and the header are written. Returns False, leaving the
+    file untouched, when the new shape does not fit in the old header.
+    """
+    fmt = np.lib.format
+    with open(path, "r+b") as f:
+        version = fmt.read_magic(f)
+        read_header = (fmt.read_array_header_1_0 if version == (1, 0)
+                       else fmt.read_array_header_2_0)
+        shape, fortran, dtype = read_header(f)
+        offset = f.tell()
+        header = io.BytesIO()
+        write_header = (fmt.write_array_header_1_0 if version == (1, 0)
+                        else fmt.write_array_header_2_0)
+        write_header(header, {"descr": fmt.dtype_to_descr(dtype), "fortran_order": fortran,
+                              "shape": (n_rows + len(blocks),) + tuple(shape[1:])})
+        if fortran or len(header.getvalue()) != offset:
+            return False
+        row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize
+        f.seek(offset + n_rows * row_bytes)
+        for block in blocks:
+            f.write(np.ascontiguousarray(block, dtype=dtype).tobytes())
+        # The header goes last, so an interrupted append leaves the old shape
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, "meta.json"))
+
+
+class PanelStore:
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, "meta.json")) as f:
+            self._meta = meta = json.load(f)
+        self.geo = pd.Index(meta["geo"], name="GEO_ID")
+        self.years = list(meta["years"])
+        self.variables = list(meta["variables"])
+        # Source column of each variable, used when appending years
+        self.columns = list(meta.get("columns", self.variables))
+        self.year_major = meta.get("axes") == AXES
+        self._year_pos = {yr: i for i, yr in enumerate(self.years)}
+        self._var_pos = {v: i for i, v in enumerate(self.variables)}
+        self.values = self._load("values")
+        moe_path = os.path.join(path, "moes.npy")
+        self.moes = self._load("moes") if os.path.exists(moe_path) else None
+
+    def _load(self, name):
+        arr = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode=self.mode)
+        if not self.year_major:
+            return arr
+        # Rows past the years in meta.json are an append that did not finish
+        return arr[:len(self.years)].transpose(1, 0, 2)
+
+    @classmethod
+    def create(cls, path, geo, years, variables, moes=True, columns=None):
+        """Write an empty (all-NaN) store and open it for writing."""
+        os.makedirs(path, exist_ok=True)
+        shape = (len(years), len(geo), len(variables))
+        for name in ("values", "moes") if moes else ("values",):
+            arr = np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+",
+                                            dtype=DTYPE, shape=shape)
+            arr[:] = np.nan
+            arr.flush()
+            del arr
+        meta = {"geo": [str(g) for g in geo], "years": [int(yr) for yr in years],
+                "variables": list(variables), "columns": list(columns or variables),
+                "axes": AXES}
+        _write_meta(path, meta)
+        return cls(path, mode="r+")
+
+    @classmethod
+    def from_frames(cls, path, frames, variables, geo_col="GEO_ID", moes=True):
+        """Build a store from {year: frame}, one row per geography per frame.
+
+        `variables` is a list of estimate columns or a dict mapping them to
+        the variable names to store. With `moes`, each estimate's MOE column
+        (..._001E -> ..._001M) fills the MOE array where the frame has it.
+        Geographies are the sorted union over all years; a geography missing
+        in a year stays NaN. The store is written to a temporary folder and
+        swapped in, so readers never see a half-written panel.
+        """
+        if not isinstance(variables, dict):
+            variables = {col: col for col in variables}
+        years = sorted(frames)
+        geo = pd.Index(sorted(set().union(*(frames[yr][geo_col] for yr in years))))
+        cols = list(variables)
+
+        tmp = path.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        store = cls.create(tmp, geo, years, list(variables.values()), moes=moes, columns=cols)
+        for j, yr in enumerate(years):
+            values, errors = _year_block(frames[yr], geo, cols, geo_col, moes)
+            store.values[:, j, :] = values
+            if moes:
+                store.moes[:, j, :] = errors
+        store.flush()
+        del store
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls(path)
+
+    @classmethod
+    def append_years(cls, path, frames, geo_col="GEO_ID"):
+        """Add new years ({year: frame}) to the store at `path` and return it reopened.
+
+        Frames need the store's source columns (and MOE columns). When every
+        new year is later than the stored ones and brings no new GEO_ID, each
+        year is written onto the end of the .npy files and only the headers
+        and meta.json change, so the cost is that of the new years alone.
+        Otherwise (an earlier year, new geographies or an old geo-major store)
+        the store is rebuilt from its own arrays plus the frames; no earlier
+        year is re-read either way.
+        """
+        store = cls(path)
+        years = sorted(frames)
+        present = sorted(set(years) & set(store.years))
+        if present:
+            raise ValueError(f"Years already in the panel store: {present}")
+        moes = store.moes is not None
+        new_geo = pd.Index(sorted(set().union(*(frames[yr][geo_col] for yr in years))))
+
+        if store.year_major and years[0] > store.years[-1] and new_geo.isin(store.geo).all():
+            blocks = [_year_block(frames[yr], store.geo, store.columns, geo_col, moes)
+                      for yr in years]
+            n_rows, geo, meta = len(store.years), store.geo, store._meta
+            del store
+            grown = _grow_npy(os.path.join(path, "values.npy"), n_rows, [b[0] for b in blocks])
+            if grown and moes:
+                grown = _grow_npy(os.path.join(path, "moes.npy"), n_rows, [b[1] for b in blocks])
+            if grown:
+                _write_meta(path, dict(meta, years=meta["years"] + years))
+                return cls(path)
+            store = cls(path)
+
+        geo = store.geo.union(new_geo)
+        all_years = sorted(store.years + years)
+        tmp = path.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        out = cls.create(tmp, geo, all_years, store.variables, moes=moes, columns=store.columns)
+        rows = geo.get_indexer(store.geo)
+        for j, yr in enumerate(store.years):
+            k = all_years.index(yr)
+            out.values[rows, k, :] = store.values[:, j, :]
+            if moes:
+                out.moes[rows, k, :] = store.moes[:, j, :]
+        for yr in years:
+            values, errors = _year_block(frames[yr], geo, store.columns, geo_col, moes)
+            out.values[:, all_years.index(yr), :] = values
+            if moes:
+                out.moes[:, all_years.index(yr), :] = errors
+        out.flush()
+        del store, out
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls(path)
+
+    @classmethod
+    def from_long(cls, path, df_long, variables, geo_col="GEO_ID", year_col="Year", moes=True):
+        """from_frames for a long panel such as the output of ingest.build_long."""
+        frames = {int(yr): df for yr, df in df_long.groupby(year_col, sort=True)}
+        return cls.from_frames(path, frames, variables, geo_col=geo_col, moes=moes)
+
+    # Workers get the path and map the files themselves
+    def __getstate__(self):
+        return {"path": self.path, "mode": self.mode}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["mode"])
+
+    def __repr__(self):
+        return (f"PanelStore({self.path!r}, geo={len(self.geo)}, years={self.years}, "
+                f"variables={self.variables})")
+
+    def flush(self):
+        for arr in (self.values, self.moes):
+            if isinstance(arr, np.memmap):
+                arr.flush()
+
+    def year_pos(self, year):
+        return self._year_pos[year]
+
+    def var_pos(self, variable):
+        return self._var_pos[variable]
+
+    def geo_pos(self, geo_ids):
+        """Row positions of `geo_ids`; raises KeyError if any is missing."""
+        pos = self.geo.get_indexer(pd.Index(geo_ids))
+        if (pos < 0).any():
+            missing = list(pd.Index(geo_ids)[pos < 0][:5])
+            raise KeyError(f"GEO_IDs not in the panel: {missing}")
+        return pos
+
+    def view(self, variable=None, year=None, moe=False):
+        """Zero-copy slice of the estimates (or MOEs) for one variable and/or year.
+
+        view('Household_ct') is [geo, year], view(year=2019) is
+        [geo, variable], and giving both returns a [geo] vector.
+        """
+        arr = self.moes if moe else self.values
+        if arr is None:
+            raise ValueError("This panel was built without MOEs")
+        j = slice(None) if year is None else self._year_pos[year]
+        v = slice(None) if variable is None else self._var_pos[variable]
+        return arr[:, j, v]
+
+    def frame(self, variable, moe=False):
+        """[geo x year] DataFrame over the mapped data for one variable."""
+        return pd.DataFrame(self.view(variable, moe=moe), index=self.geo,
+                            columns=pd.Index(self.years, name="Year"), copy=False)
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+
+from ingest import file_hash
+from instrument import span
+
+
+class Step:
+    """One node of the build graph.
+
+    `func(**params)` must write every path in `outputs`. A step is up to date
+    when its outputs exist and the hash of its input files, parameters and
+    upstream outputs matches the one recorded on its last successful run.
+    Steps with `process=True` (anything that draws with pyplot, which is not
+    thread-safe) run in a worker process instead of a thread.
+
+    A step whose outputs can be extended in place (the panel store gaining a
+    year) also gets `append(added, **params)` and the name of the list
+    parameter that `grows`. When only new items were added to that list and
+    nothing the outputs were built from changed, `append` is called with the
+    new items instead of rebuilding everything with `func`.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), deps=(), params=None,
+                 process=False, append=None, grows=None):
+        self.name = name
+        self.process = process
+        self.func = func
+        self.append = append
+        self.grows = grows
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = dict(params or {})
+
+    def __repr__(self):
+        return f"Step({self.name!r}, deps={self.deps})"
+
+
+def _hash_paths(paths):
+    h = hashlib.sha1()
+    for path in sorted(paths):
+        h.update(path.encode())
+        h.update((file_hash(path) if os.path.exists(path) else "missing").encode())
+    return h.hexdigest()
+
+
+def _plain(params):
+    return json.loads(json.dumps(params, sort_keys=True, default=str))
+
+
+def _call(name, func, params):
+    # Module level so it can be sent to a process pool
+    with span(f"pipeline.{name}"):
+        func(**params)
+
+
+class Pipeline:
+    """Incremental, dependency-aware runner for the project's build steps.
+
+    Hashes are kept in a JSON state file, so a re-run only executes steps
+    whose inputs changed (directly or through an upstream step whose outputs
+    changed). Independent steps run concurrently in a thread pool.
+
+    Each record also keeps a `lineage`: the output hash of the step's last
+    full build, carried over unchanged by appends. An appendable step may
+    append only while every dependency it was built from has the lineage it
+    recorded, i.e. has itself only been appended to since.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.steps = {}
+
+    def add(self, name, func, inputs=(), outputs=(), deps=(), params=None, process=False,
+            append=None, grows=None):
+        if name in self.steps:
+            raise ValueError(f"Duplicate step name: {name}")
+        if (append is None) != (grows is None):
+            raise ValueError(f"Step {name!r} needs both `append` and `grows`, or neither")
+        self.steps[name] = Step(name, func, inputs, outputs, deps, params, process,
+                                append, grows)
+        return self.steps[name]
+
+    # ---- state ----
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self, state):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.state_path)
+
+    def signature(self, step, state):
+        """Hash of everything the step's outputs depend on."""
+        h = hashlib.sha1()
+        h.update(step.name.encode())
+        h.update(json.dumps(step.params, sort_keys=True, default=str).encode())
+        h.update(_hash_paths(step.inputs).encode())
+        for dep in sorted(step.deps):
+            h.update(state.get(dep, {}).get("outputs", "").encode())
+        return h.hexdigest()
+
+    def is_stale(self, step, state):
+        record = state.get(step.name)
+        if record is None or not all(os.path.exists(p) for p in step.outputs):
+            return True
+        return record.get("signature") != self.signature(step, state)
+
+    def _record(self, step, state, lineage=None):
+        outputs = _hash_paths(step.outputs)
+        return {
+            "signature": self.signature(step, state),
+            "outputs": outputs,
+            "lineage": lineage or outputs,
+            "inputs": _hash_paths(step.inputs),
+            "params": _plain(step.params),
+            "deps": {dep: state.get(dep, {}).get("lineage") for dep in step.deps},
+        }
+
+    def appendable(self, step, state):
+        """Items added to `step.grows` if the stale step can be appended to, else None."""
+        record = state.get(step.name)
+        if step.append is None or record is None or "deps" not in record:
+            return None
+        if not all(os.path.exists(p) for p in step.outputs):
+            return None
+        if record["inputs"] != _hash_paths(step.inputs):
+            return None
+        old, new = record["params"], _plain(step.params)
+        if ({k: v for k, v in old.items() if k != step.grows}
+                != {k: v for k, v in new.items() if k != step.grows}):
+            return None
+        if not set(old[step.grows]) <= set(new[step.grows]):
+            return None
+        # Everything the outputs were built from is unchanged (or only appended to)
+        for dep, lineage in record["deps"].items():
+            if (lineage is None or dep not in step.deps
+                    or state.get(dep, {}).get("lineage") != lineage):
+                return None
+        added = [x for x in step.params[step.grows] if _plain(x) not in old[step.grows]]
+        return added or None
+
+    # ---- graph ----
+
+    def _closure(self, targets):
+        """The targets plus everything upstream of them, in dependency order."""
+        order, seen, visiting = [], set(), set()
+
+        def visit(name):
+            if name in seen:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in pipeline at step {name!r}")
+            if name not in self.steps:
+                raise KeyError(f"Unknown step {name!r}")
+            visiting.add(name)
+            for dep in self.steps[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            seen.add(name)
+            order.append(name)
+
+        for name in targets:
+            visit(name)
+        return order
+
+    def downstream(self, names):
+        """Every step that depends (directly or not) on any of `names`."""
+        out = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for step in self.steps.values():
+                if step.name not in out and any(dep in out for dep in step.deps):
+                    out.add(step.name)
+                    changed = True
+        return out
+
+    # ---- running ----
+
+    def run(self, targets=None, workers=None, force=False, log=print):
+        """Bring `targets` (default: every step) up to date.
+
+        Returns {step name: 'ran' | 'appended' | 'skipped'}.
+        """
+        from contextlib import ExitStack
+        from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                        ThreadPoolExecutor, wait)
+
+        order = self._closure(targets or list(self.steps))
+        state = self._load_state()
+        status = {}
+        pending = list(order)
+        running = {}
+
+        workers = workers or os.cpu_count() or 1
+        procs = None
+        with ThreadPoolExecutor(max_workers=workers) as pool, ExitStack() as stack:
+            while pending or running:
+                # Start every step whose dependencies are finished
+                for name in list(pending):
+                    step = self.steps[name]
+                    if any(dep not in status for dep in step.deps):
+                        continue
+                    pending.remove(name)
+                    if not force and not self.is_stale(step, state):
+                        status[name] = "skipped"
+                        if "lineage" not in state.get(name, {}):
+                            # Records written before lineages existed
+                            state[name] = self._record(step, state)
+                            self._save_state(state)
+                        continue
+                    added = None if force else self.appendable(step, state)
+                    if added:
+                        log(f"[pipeline] appending {added} to {name}")
+                        func, params = step.append, dict(step.params, added=added)
+                    else:
+                        log(f"[pipeline] running {name}")
+                        func, params = step.func, step.params
+                    if step.process:
+                        if procs is None:
+                            procs = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+                        fut = procs.submit(_call, step.name, func, params)
+                    else:
+                        fut = pool.submit(_call, step.name, func, params)
+                    running[fut] = (step, bool(added))
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    step, appended = running.pop(fut)
+                    fut.result()
+                    missing = [p for p in step.outputs if not os.path.exists(p)]
+                    if missing:
+                        raise RuntimeError(f"Step {step.name!r} did not write {missing}")
+                    lineage = state[step.name]["lineage"] if appended else None
+                    state[step.name] = self._record(step, state, lineage)
+                    self._save_state(state)
+                    status[step.name] = "appended" if appended else "ran"
+        return status
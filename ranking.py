@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+
+from changes import METRICS, compute_changes, pair_indices
+from uncertainty import change_moes, is_significant
+
+
+def top_k_indices(scores, k, largest=True, mask=None):
+    """Positions of the k largest (or smallest) scores, best first.
+
+    Uses a partition so only the k selected values get sorted; ties keep row
+    order. NaNs and rows outside `mask` are never returned.
+    """
+    scores = np.asarray(scores, dtype="float64")
+    valid = ~np.isnan(scores)
+    if mask is not None:
+        valid &= np.asarray(mask, dtype=bool)
+    idx = np.flatnonzero(valid)
+    key = -scores[idx] if largest else scores[idx]
+    if k <= 0:
+        return idx[:0]
+    if k < len(idx):
+        # Values tied with the k-th are taken in row order, as a stable sort would
+        kth = np.partition(key, k - 1)[k - 1]
+        part = np.flatnonzero(key < kth)
+        part = np.concatenate([part, np.flatnonzero(key == kth)[:k - len(part)]])
+    else:
+        part = np.arange(len(idx))
+    part = part[np.argsort(key[part], kind="stable")]
+    return idx[part]
+
+
+def _filter_mask(df, state=None, state_col="stab", min_base=None, base_col=None, mask=None):
+    mask = np.ones(len(df), dtype=bool) if mask is None else np.asarray(mask, dtype=bool).copy()
+    if state is not None:
+        states = [state] if isinstance(state, str) else list(state)
+        mask &= df[state_col].isin(states).to_numpy()
+    if min_base is not None:
+        mask &= (df[base_col].to_numpy(dtype="float64") >= min_base)
+    return mask
+
+
+def top_k(df, column, k=20, largest=True, state=None, state_col="stab",
+          min_base=None, base_col=None, mask=None):
+    """Drop-in for df.sort_values(column, ascending=False).head(k).
+
+    Optionally restricted to one or more states (`state_col` is 'stab' in the
+    crosswalk files, 'State abbr.' in the consolidated workbook), to rows
+    whose `base_col` is at least `min_base` households, and to rows where
+    `mask` is True (e.g. uncertainty.is_significant of the change).
+    """
+    mask = _filter_mask(df, state, state_col, min_base, base_col, mask)
+    return df.iloc[top_k_indices(df[column], k, largest=largest, mask=mask)]
+
+
+def bottom_k(df, column, k=20, **kwargs):
+    return top_k(df, column, k, largest=False, **kwargs)
+
+
+def _descending_order(scores):
+    # Descending order per column with NaNs at the end
+    key = np.where(np.isnan(scores), np.inf, -scores)
+    return np.argsort(key, axis=0, kind="stable").astype(np.int32)
+
+
+def _ascending_order(order, scores):
+    # Reverse of a stable descending order (NaNs already dropped), with each run
+    # of tied scores flipped back so ties stay in row order, as top_k has them
+    order = order[::-1]
+    vals = scores[order]
+    starts = np.flatnonzero(np.r_[True, vals[1:] != vals[:-1]])
+    run = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(vals)]))
+    ends = np.r_[starts[1:], len(vals)]
+    out = np.empty_like(order)
+    out[starts[run] + ends[run] - 1 - np.arange(len(vals))] = order
+    return out
+
+
+class RankIndex:
+    """Precomputed rank order for every metric and year pair.
+
+    Building the index sorts each (metric, pair) column once; afterwards a
+    top/bottom-N query, with or without state / minimum-base filters, is a
+    masked walk down the stored order and never re-sorts. If `moes` are given
+    the significance of every change is precomputed as well, so queries can
+    drop changes that are within sampling error. add_year() extends the
+    index with a new release, scoring and sorting only the pairs that
+    involve it.
+    """
+
+    def __init__(self, values, years, geo=None, states=None, pairs=None,
+                 metrics=tuple(METRICS), moes=None, level=0.90):
+        self.values = np.asarray(values, dtype="float64")
+        self.years = list(years)
+        self.geo = pd.Index(range(len(self.values)) if geo is None else geo)
+        self.states = None if states is None else np.asarray(states, dtype=object)
+        self.moes = None if moes is None else np.asarray(moes, dtype="float64")
+        self.level = level
+        self.scores, self.pairs = compute_changes(self.values, self.years, pairs, metrics)
+        self.pair_pos = {pair: j for j, pair in enumerate(self.pairs)}
+        self.significant = None
+        if moes is not None:
+            self.significant = self._significance(self.pairs)
+        self.order = {metric: _descending_order(scores) for metric, scores in self.scores.items()}
+
+    def _significance(self, pairs):
+        diff, _ = compute_changes(self.values, self.years, pairs, ("abs",))
+        moe, _ = change_moes(self.values, self.moes, self.years, pairs)
+        return is_significant(diff["abs"], moe["abs"], self.level)
+
+    def add_year(self, year, values, moes=None, pairs=None):
+        """Add one year's values (in the index's row order) and rank only its new pairs.
+
+        `pairs` defaults to every pair between the new year and the existing
+        ones, as in an index built over all pairs; pass e.g. [(2023, 2024)]
+        to extend a year-over-year index. Scores and orders of the existing
+        pairs are kept as they are.
+        """
+        if year in self.years:
+            raise ValueError(f"{year} is already in the index")
+        if self.moes is not None and moes is None:
+            raise ValueError("This RankIndex has MOEs; pass the new year's moes too")
+        col = int(np.searchsorted(self.years, year))
+        self.years.insert(col, year)
+        self.values = np.insert(self.values, col, np.asarray(values, dtype="float64"), axis=1)
+        if self.moes is not None:
+            self.moes = np.insert(self.moes, col, np.asarray(moes, dtype="float64"), axis=1)
+        if pairs is None:
+            pairs = [(min(yr, year), max(yr, year)) for yr in self.years if yr != year]
+        pairs = [pair for pair in pairs if pair not in self.pair_pos]
+
+        scores, pairs = compute_changes(self.values, self.years, pairs, tuple(self.scores))
+        for metric, new in scores.items():
+            self.scores[metric] = np.hstack([self.scores[metric], new])
+            self.order[metric] = np.hstack([self.order[metric], _descending_order(new)])
+        if self.significant is not None:
+            self.significant = np.hstack([self.significant, self._significance(pairs)])
+        self.pairs = self.pairs + pairs
+        self.pair_pos = {pair: j for j, pair in enumerate(self.pairs)}
+        return pairs
+
+    @classmethod
+    def from_frame(cls, df, columns, geo_col=None, state_col=None, moe_columns=None, **kwargs):
+        """Build from a wide frame; `columns` (and `moe_columns`) map year -> column."""
+        years = sorted(columns)
+        values = df[[columns[yr] for yr in years]].to_numpy(dtype="float64")
+        if moe_columns is not None:
+            kwargs["moes"] = df[[moe_columns[yr] for yr in years]].to_numpy(dtype="float64")
+        geo = df.index if geo_col is None else df[geo_col]
+        states = None if state_col is None else df[state_col]
+        return cls(values, years, geo=geo, states=states, **kwargs)
+
+    def query(self, metric, base, target, n=20, largest=True, state=None, min_base=None,
+              significant_only=False):
+        """Top (or bottom) n geographies for one metric and year pair.
+
+        Returns a frame of the base/target values and the metric, best first.
+        """
+        j = self.pair_pos[(base, target)]
+        scores = self.scores[metric][:, j]
+        order = self.order[metric][:, j]
+        n_valid = int((~np.isnan(scores)).sum())
+        order = order[:n_valid] if largest else _ascending_order(order[:n_valid], scores)
+
+        mask = np.ones(len(self.values), dtype=bool)
+        if state is not None:
+            states = [state] if isinstance(state, str) else list(state)
+            mask &= np.isin(self.states, states)
+        base_idx, target_idx, _ = pair_indices(self.years, [(base, target)])
+        if min_base is not None:
+            mask &= self.values[:, base_idx[0]] >= min_base
+        if significant_only:
+            if self.significant is None:
+                raise ValueError("RankIndex was built without MOEs")
+            mask &= self.significant[:, j]
+        picked = order[mask[order]][:n]
+
+        out = pd.DataFrame({
+            base: self.values[picked, base_idx[0]],
+            target: self.values[picked, target_idx[0]],
+            metric: scores[picked],
+        }, index=self.geo[picked])
+        if self.states is not None:
+            out.insert(0, "state", self.states[picked])
+        return out
+
+    def top(self, metric, base, target, n=20, **kwargs):
+        return self.query(metric, base, target, n, largest=True, **kwargs)
+
+    def bottom(self, metric, base, target, n=20, **kwargs):
+        return self.query(metric, base, target, n, largest=False, **kwargs)
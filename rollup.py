@@ -0,0 +1,243 @@
+"""PUMA -> county -> state -> national rollups in one pass per level.
+
+Rollup builds its group indexes once from the PUMA GEO_IDs (state from the
+code, county through the crosswalk matching each row's PUMA vintage); after
+that, aggregating a whole [geo, year, variable] array to every level is one
+sparse product (county) and one np.add.reduceat over state-sorted rows
+(state; the nation is the sum of the states). MOEs are rolled up alongside
+as sqrt(sum of squared MOEs).
+
+    rollup = Rollup(store.geo, store.years)
+    table = rollup.table(store, sums={"S1901_C01_001E": "Household_ct"})
+    table.loc["state"]           # one row per state FIPS, Household_ct_2019, ...
+
+A Rollup over a subset of the store's years only aggregates those years,
+which is how append_rollups() adds a new release to the cached table.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import crosswalk
+from income import BRACKET_COLUMNS, median, store_counts
+from instrument import span
+from uncertainty import moe_ratio
+
+LEVELS = ("puma", "county", "state", "nation")
+
+# Household counts add up; mean income is rolled up weighted by households
+ROLLUP_SUMS = {"S1901_C01_001E": "Household_ct"}
+ROLLUP_WEIGHTED = {"S1901_C01_013E": ("Mean_Income", "S1901_C01_001E")}
+
+# Releases before 2012 use the 2000 PUMAs, which the crosswalks do not cover
+FIRST_COUNTY_YEAR = 2012
+
+
+def _vintage_matrix(xwalk, keys, rows):
+    """xwalk's target x len(keys) matrix using only the rows flagged in `rows`."""
+    return xwalk.matrix @ xwalk.align(np.where(rows, keys, ""))
+
+
+class Rollup:
+    """Group indexes from PUMA rows to county, state and nation."""
+
+    def __init__(self, geo_ids, years):
+        self.geo = pd.Index(geo_ids, name="GEO_ID")
+        self.years = list(years)
+        keys = crosswalk.geo_id_to_key(self.geo)
+
+        state_codes, self.states = pd.factorize(pd.Series(keys).str[:2], sort=True)
+        self._state_order = np.argsort(state_codes, kind="stable")
+        sorted_codes = state_codes[self._state_order]
+        self._state_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+
+        # 2022 PUMAs carry the 795P200 summary level in their GEO_ID
+        is22 = np.asarray(self.geo.str.startswith("795P200"), dtype=bool)
+        xw12 = crosswalk.load_puma12_to_county()
+        xw22 = crosswalk.load_puma22_to_county()
+        if not xw12.target.equals(xw22.target):
+            raise ValueError("PUMA12 and PUMA22 county crosswalks list different counties")
+        self.counties = xw22.target
+        self.county_matrix = sparse.csr_matrix(
+            _vintage_matrix(xw12, keys, ~is22) + _vintage_matrix(xw22, keys, is22))
+        self._county_years = np.array([yr >= FIRST_COUNTY_YEAR for yr in self.years])
+
+    def index(self, level):
+        return {"puma": self.geo, "county": self.counties, "state": self.states,
+                "nation": pd.Index(["US"])}[level]
+
+    def aggregate(self, values, moes=None):
+        """Sum a [geo, year, ...] array to every level.
+
+        Returns {level: (values, moes)} with the same trailing axes; moes are
+        None when not given. A group with no reported rows is NaN, and county
+        values for years before 2012 are NaN.
+        """
+        values = np.asarray(values, dtype="float64")
+        shape = values.shape[1:]
+        flat = values.reshape(len(values), -1)
+        has = (~np.isnan(flat)).astype("float64")
+        x = np.nan_to_num(flat)
+        sq = None if moes is None else np.nan_to_num(
+            np.asarray(moes, dtype="float64").reshape(len(values), -1)) ** 2
+
+        def finish(total, count, total_sq):
+            total = np.where(count > 0, total, np.nan)
+            moe = None if total_sq is None else np.where(count > 0, np.sqrt(total_sq), np.nan)
+            return total, moe
+
+        out = {"puma": (flat, None if moes is None else
+                        np.asarray(moes, dtype="float64").reshape(len(values), -1))}
+
+        with span("rollup.county"):
+            a = self.county_matrix
+            county = finish(a @ x, (a != 0).astype("float64") @ has,
+                            None if sq is None else a.power(2) @ sq)
+            early = np.repeat(~self._county_years, int(np.prod(shape[1:], dtype=int)))
+            for arr in county:
+                if arr is not None:
+                    arr[:, early] = np.nan
+            out["county"] = county
+
+        with span("rollup.state"):
+            order, starts = self._state_order, self._state_starts
+            out["state"] = finish(np.add.reduceat(x[order], starts, axis=0),
+                                  np.add.reduceat(has[order], starts, axis=0),
+                                  None if sq is None else
+                                  np.add.reduceat(sq[order], starts, axis=0))
+            st_total, _ = out["state"]
+            out["nation"] = finish(np.nansum(st_total, axis=0, keepdims=True),
+                                   (~np.isnan(st_total)).sum(axis=0, keepdims=True),
+                                   None if sq is None else sq.sum(axis=0, keepdims=True))
+
+        return {level: tuple(None if arr is None else arr.reshape((len(arr),) + shape)
+                             for arr in res)
+                for level, res in out.items()}
+
+    def aggregate_weighted(self, values, weights, moes=None, weight_moes=None):
+        """Weighted mean of `values` (e.g. mean income by households) at every level.
+
+        Rolls up values * weights and the weights, then divides; MOEs use the
+        product and ratio approximations from uncertainty.py.
+        """
+        values = np.asarray(values, dtype="float64")
+        weights = np.asarray(weights, dtype="float64")
+        num = values * weights
+        num_moe = w_moe = None
+        if moes is not None and weight_moes is not None:
+            num_moe = np.hypot(weights * moes, values * weight_moes)
+            w_moe = np.where(np.isnan(values), np.nan, weight_moes)
+        nums = self.aggregate(num, num_moe)
+        dens = self.aggregate(np.where(np.isnan(values), np.nan, weights), w_moe)
+        out = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for level in LEVELS:
+                (n, n_moe), (d, d_moe) = nums[level], dens[level]
+                mean = np.where(d > 0, n / d, np.nan)
+                if level == "puma":
+                    out[level] = (values, moes)
+                elif n_moe is None:
+                    out[level] = (mean, None)
+                else:
+                    out[level] = (mean, moe_ratio(n, d, n_moe, d_moe))
+        return out
+
+    def table(self, store, sums=ROLLUP_SUMS, weighted=ROLLUP_WEIGHTED):
+        """One (level, geo)-indexed frame with '<name>_<year>' and '<name>_MOE_<year>'.
+
+        `store` is a panel_store.PanelStore holding (at least) this rollup's
+        years. When it holds the S1901 income brackets, per-bracket household
+        counts are rolled up too and every level gets an interpolated
+        'Median_Income_<year>' (no MOE).
+        """
+        j = [store.year_pos(yr) for yr in self.years]
+
+        def var(arr, code):
+            return None if arr is None else arr[:, j, store.var_pos(code)]
+
+        results = {}
+        codes = list(sums)
+        pos = [store.var_pos(c) for c in codes]
+        rolled = self.aggregate(store.values[:, j][:, :, pos],
+                                None if store.moes is None else store.moes[:, j][:, :, pos])
+        for k, code in enumerate(codes):
+            results[sums[code]] = {level: tuple(None if a is None else a[:, :, k] for a in res)
+                                   for level, res in rolled.items()}
+        for code, (name, weight) in weighted.items():
+            results[name] = self.aggregate_weighted(var(store.values, code),
+                                                    var(store.values, weight),
+                                                    var(store.moes, code),
+                                                    var(store.moes, weight))
+        if set(BRACKET_COLUMNS) <= set(store.variables):
+            counts = self.aggregate(store_counts(store, self.years))
+            results["Median_Income"] = {level: (median(c), None)
+                                        for level, (c, _) in counts.items()}
+
+        frames = []
+        for level in LEVELS:
+            cols = {}
+            for name, res in results.items():
+                est, moe = res[level]
+                for j, yr in enumerate(self.years):
+                    cols[f"{name}_{yr}"] = est[:, j]
+                    if moe is not None:
+                        cols[f"{name}_MOE_{yr}"] = moe[:, j]
+            idx = self.index(level)
+            frame = pd.DataFrame(cols, index=pd.MultiIndex.from_product(
+                [[level], idx.astype(str)], names=["level", "geo"]))
+            frames.append(frame)
+        table = pd.concat(frames)
+        fips = table.index.get_level_values("geo").str.split("US").str[-1].str[:2]
+        table.insert(0, "stab", fips.map(crosswalk.state_abbr()).values)
+        return table
+
+
+def _write_table(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    table.to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def build_rollups(store, path, years=None):
+    """Write the multi-level rollup table for a PanelStore (or some of its years) to Parquet."""
+    table = Rollup(store.geo, store.years if years is None else years).table(store)
+    _write_table(table, path)
+    return table
+
+
+def append_rollups(store, path, years):
+    """Add `years` of a PanelStore to the rollup table at `path`.
+
+    Only the new years are aggregated; the existing columns are read back
+    as they are. Rows for geographies the store gained are NaN in the old
+    years, which is what a fresh build gives them too.
+    """
+    new = Rollup(store.geo, years).table(store)
+    old = pd.read_parquet(path)
+    clash = sorted(set(old.columns) & set(new.columns) - {"stab"})
+    if clash:
+        raise ValueError(f"Rollup columns already present: {clash[:5]}")
+    table = pd.concat([old.drop(columns="stab").reindex(new.index), new.drop(columns="stab")],
+                      axis=1)
+
+    # Same column order as a full build: each name's years in order, MOE after estimate
+    names = list(dict.fromkeys(re.sub(r"(_MOE)?_\d{4}$", "", c) for c in table.columns))
+
+    def order(col):
+        m = re.fullmatch(r"(.*?)(_MOE)?_(\d{4})", col)
+        return names.index(m.group(1)), int(m.group(3)), bool(m.group(2))
+
+    table = table[sorted(table.columns, key=order)]
+    table.insert(0, "stab", new["stab"])
+    _write_table(table, path)
+    return table
+
+
+def load_rollups(path, level=None):
+    """Read the cached rollup table, optionally one level only."""
+    table = pd.read_parquet(path)
+    return table if level is None else table.loc[level]
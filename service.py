@@ -0,0 +1,385 @@
+"""Local HTTP/JSON query service over the household panel.
+
+    python service.py                       # http://127.0.0.1:8765
+    python service.py --port 9000 --cache-size 4096
+
+Years are the releases found in Raw Data; every --watch seconds the service
+looks for a new one and adds it, ranking only the year pairs that involve
+it (RankIndex.add_year) instead of reloading the whole history.
+
+The PUMA and county panels, crosswalk lookups, centroids and rank indexes
+are loaded once at startup; every query is answered from memory, and the
+encoded responses are kept in a bounded LRU cache. Endpoints (GET, all
+parameters in the query string; level is 'puma' or 'county'):
+
+    /series?level=county&geo=24510
+    /change?level=puma&geo=7950000US2400804&base=2019&target=2023
+    /top?level=county&metric=pct&base=2019&target=2023&n=20&state=CA&min_base=50000&bottom=1
+    /map?level=county&metric=pct&base=2022&target=2023
+    /lookup?county=24510   /lookup?puma22=2400804   /lookup?puma12=2400804   /lookup?level=county&state=MD
+    /tiles/county_pct_change/2023/5/8/12.png (PNG tiles written by tiles.py)
+    /health
+"""
+import argparse
+import asyncio
+import functools
+import json
+import math
+import os
+import re
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+import crosswalk
+from changes import METRICS
+from instrument import span
+from ranking import RankIndex
+from tables import household_panel, panel_years
+from tiles import TILES_DIR
+
+LEVELS = ("puma", "county")
+
+TILE_PATH = re.compile(r"/tiles/(\w+)/(\d{4})/(\d+)/(\d+)/(\d+)\.png")
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error"}
+
+# Largest n accepted by /top
+MAX_ROWS = 1000
+
+
+def _num(x):
+    x = float(x)
+    return None if math.isnan(x) else x
+
+
+def _text(x):
+    return x if isinstance(x, str) else None
+
+
+def _nums(values):
+    return [None if math.isnan(x) else x for x in np.asarray(values, dtype="float64").tolist()]
+
+
+def _group_lists(keys, values):
+    out = {}
+    for k, v in zip(keys, values):
+        out.setdefault(k, [])
+        if v not in out[k]:
+            out[k].append(v)
+    return out
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class PanelService:
+    """Everything the endpoints need, loaded once and indexed for lookups."""
+
+    def __init__(self, years=None, cache_size=1024, tiles_dir=TILES_DIR):
+        self.tiles_dir = tiles_dir
+        self.levels = {}
+        for level in LEVELS:
+            with span("service.load", level=level):
+                frame = household_panel(level, years)
+                cols = [c for c in frame.columns if c.startswith("Household_ct_")]
+                panel_years = [int(c.rsplit("_", 1)[1]) for c in cols]
+                index = RankIndex.from_frame(frame, dict(zip(panel_years, cols)),
+                                             state_col="stab")
+                self.levels[level] = {
+                    "level": level,
+                    "frame": frame,
+                    "years": panel_years,
+                    "values": index.values,
+                    "index": index,
+                    "pos": {geo: i for i, geo in enumerate(frame.index)},
+                    "states": {st: frame.index[(frame["stab"] == st).to_numpy()].tolist()
+                               for st in frame["stab"].dropna().unique()},
+                }
+
+        pts = crosswalk.county_centroids().reindex(self.levels["county"]["frame"].index)
+        self.county_latlon = pts[["IntPtLat", "IntPtLon"]].to_numpy(dtype="float64")
+
+        p12 = crosswalk._read_crosswalk_csv(crosswalk.PUMA12_TO_PUMA22_CSV)
+        p12 = p12.dropna(subset=["puma12"])
+        k12 = crosswalk.puma_key(p12["state"], p12["puma12"])
+        k22 = crosswalk.puma_key(p12["state"], p12["puma22"])
+        p22 = crosswalk._read_crosswalk_csv(crosswalk.PUMA22_TO_COUNTY_CSV)
+        c22 = crosswalk.puma_key(p22["state"], p22["puma22"])
+        county = p22["county"].str.zfill(5).tolist()
+        self.lookups = {
+            "puma12": {"puma22": _group_lists(k12, k22)},
+            "puma22": {"puma12": _group_lists(k22, k12), "county": _group_lists(c22, county)},
+            "county": {"puma22": _group_lists(county, c22)},
+        }
+
+        self.respond = functools.lru_cache(maxsize=cache_size)(self._respond)
+
+    # ---- new releases ----
+
+    def new_years(self):
+        """Panel years in Raw Data that are not loaded yet."""
+        loaded = set(self.levels["county"]["years"])
+        return [yr for yr in panel_years() if yr not in loaded]
+
+    @staticmethod
+    def load_year(year):
+        """{level: household counts of one year}; safe to run off the event loop."""
+        return {level: household_panel(level, [year])[f"Household_ct_{year}"]
+                for level in LEVELS}
+
+    def add_year(self, year, counts):
+        """Add a year loaded by load_year, ranking only the pairs that involve it."""
+        for level, lvl in self.levels.items():
+            values = counts[level].reindex(lvl["frame"].index)
+            lvl["frame"][f"Household_ct_{year}"] = values
+            lvl["index"].add_year(year, values.to_numpy(dtype="float64"))
+            lvl["years"] = lvl["index"].years
+            lvl["values"] = lvl["index"].values
+        self.respond.cache_clear()
+
+    # ---- parameter helpers ----
+
+    def _level(self, params):
+        level = params.get("level", "county")
+        if level not in self.levels:
+            raise QueryError(400, f"level must be one of {list(LEVELS)}")
+        return self.levels[level]
+
+    def _geo(self, lvl, params):
+        if "geo" not in params:
+            raise QueryError(400, "missing parameter 'geo'")
+        try:
+            key = crosswalk.level_key(params["geo"], lvl["level"])
+        except ValueError as exc:
+            raise QueryError(400, str(exc)) from None
+        if key not in lvl["pos"]:
+            raise QueryError(404, f"unknown geography {params['geo']!r}")
+        return key
+
+    @staticmethod
+    def _int(params, name, default=None):
+        if name not in params:
+            if default is None:
+                raise QueryError(400, f"missing parameter {name!r}")
+            return default
+        try:
+            return int(params[name])
+        except ValueError:
+            raise QueryError(400, f"{name} must be an integer") from None
+
+    def _pair(self, lvl, params):
+        base = self._int(params, "base", 2019)
+        target = self._int(params, "target", 2023)
+        if (base, target) not in lvl["index"].pair_pos:
+            raise QueryError(400, f"no data for {base} -> {target}; years are {lvl['years']}")
+        return base, target
+
+    def _metric(self, params):
+        metric = params.get("metric", "pct")
+        if metric not in METRICS:
+            raise QueryError(400, f"metric must be one of {list(METRICS)}")
+        return metric
+
+    # ---- endpoints ----
+
+    def series(self, params):
+        lvl = self._level(params)
+        geo = self._geo(lvl, params)
+        i = lvl["pos"][geo]
+        row = lvl["frame"].iloc[i]
+        return {"geo": geo, "name": _text(row["name"]), "stab": _text(row["stab"]),
+                "years": lvl["years"], "households": _nums(lvl["values"][i])}
+
+    def change(self, params):
+        lvl = self._level(params)
+        geo = self._geo(lvl, params)
+        base, target = self._pair(lvl, params)
+        i, j = lvl["pos"][geo], lvl["index"].pair_pos[(base, target)]
+        out = {"geo": geo, "name": _text(lvl["frame"]["name"].iloc[i]),
+               "base": base, "target": target}
+        out.update({m: _num(scores[i, j]) for m, scores in lvl["index"].scores.items()})
+        return out
+
+    def top(self, params):
+        lvl = self._level(params)
+        metric = self._metric(params)
+        base, target = self._pair(lvl, params)
+        n = self._int(params, "n", 20)
+        if not 1 <= n <= MAX_ROWS:
+            raise QueryError(400, f"n must be between 1 and {MAX_ROWS}")
+        try:
+            min_base = float(params["min_base"]) if "min_base" in params else None
+        except ValueError:
+            raise QueryError(400, "min_base must be a number") from None
+        state = params["state"].split(",") if "state" in params else None
+        largest = params.get("bottom", "0") in ("0", "false", "")
+        res = lvl["index"].query(metric, base, target, n, largest=largest, state=state,
+                                 min_base=min_base)
+        names = lvl["frame"]["name"].reindex(res.index)
+        return {"metric": metric, "base": base, "target": target,
+                "rows": [{"geo": geo, "name": _text(name), "stab": _text(st),
+                          "base_value": _num(b), "target_value": _num(t), "value": _num(v)}
+                         for geo, name, st, b, t, v in zip(res.index, names, res["state"],
+                                                           res[base], res[target], res[metric])]}
+
+    def map(self, params):
+        if params.get("level", "county") != "county":
+            raise QueryError(400, "map data is only available at the county level")
+        lvl = self.levels["county"]
+        metric = self._metric(params)
+        base, target = self._pair(lvl, params)
+        values = lvl["index"].scores[metric][:, lvl["index"].pair_pos[(base, target)]]
+        keep = ~np.isnan(self.county_latlon).any(axis=1) & ~np.isnan(values)
+        return {"metric": metric, "base": base, "target": target,
+                "geo": lvl["frame"].index[keep].tolist(),
+                "lat": self.county_latlon[keep, 0].tolist(),
+                "lon": self.county_latlon[keep, 1].tolist(),
+                "value": values[keep].tolist()}
+
+    def lookup(self, params):
+        for kind, targets in self.lookups.items():
+            if kind in params:
+                code = params[kind].zfill(5 if kind == "county" else 7)
+                if not any(code in m for m in targets.values()):
+                    raise QueryError(404, f"unknown {kind} {params[kind]!r}")
+                return {kind: code, **{name: m.get(code, []) for name, m in targets.items()}}
+        if "state" in params:
+            lvl = self._level(params)
+            return {"state": params["state"], "geo": lvl["states"].get(params["state"], [])}
+        raise QueryError(400, "give one of puma12, puma22, county or state")
+
+    # ---- dispatch ----
+
+    def _respond(self, path, query):
+        """(status, JSON bytes) for one request; `query` is a sorted tuple of pairs."""
+        handler = {"/series": self.series, "/change": self.change, "/top": self.top,
+                   "/map": self.map, "/lookup": self.lookup}.get(path)
+        try:
+            if handler is None:
+                raise QueryError(404, f"unknown endpoint {path!r}")
+            status, body = 200, handler(dict(query))
+            payload = json.dumps(body, allow_nan=False).encode()
+        except QueryError as exc:
+            status, payload = exc.status, json.dumps({"error": str(exc)}).encode()
+        except Exception as exc:
+            status = 500
+            payload = json.dumps({"error": f"{type(exc).__name__}: {exc}"}).encode()
+        return status, payload
+
+    def tile(self, path):
+        """(status, PNG bytes) for a tile path; a tile with no points is a 404."""
+        m = TILE_PATH.fullmatch(path)
+        if m is None:
+            return 404, b""
+        try:
+            with open(os.path.join(self.tiles_dir, *m.groups()[:-1], m.group(5) + ".png"),
+                      "rb") as f:
+                return 200, f.read()
+        except FileNotFoundError:
+            return 404, b""
+
+    def health(self):
+        info = self.respond.cache_info()
+        body = {"status": "ok", "levels": {k: len(v["frame"]) for k, v in self.levels.items()},
+                "cache": {"hits": info.hits, "misses": info.misses,
+                          "size": info.currsize, "maxsize": info.maxsize}}
+        return 200, json.dumps(body).encode()
+
+    def handle(self, target):
+        """(status, content type, body) for a request target."""
+        url = urlsplit(target)
+        if url.path.startswith("/tiles/"):
+            return (*self.tile(url.path), "image/png")
+        if url.path == "/health":
+            return (*self.health(), "application/json")
+        return (*self.respond(url.path, tuple(sorted(parse_qsl(url.query)))), "application/json")
+
+
+async def _serve_connection(service, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+            except ValueError:
+                break
+            keep_alive = (version == "HTTP/1.1"
+                          and headers.get("connection", "").lower() != "close")
+            if method != "GET":
+                status, body = 405, b'{"error": "only GET is supported"}'
+                content_type = "application/json"
+            else:
+                status, body, content_type = service.handle(target)
+            writer.write(
+                f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _watch_releases(service, interval):
+    # The new year is read in a thread; it is added between requests on the loop
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        for year in service.new_years():
+            try:
+                counts = await loop.run_in_executor(None, service.load_year, year)
+            except Exception as exc:  # e.g. a csv still being copied; retried next time
+                print(f"[service] could not load {year}: {type(exc).__name__}: {exc}")
+                continue
+            service.add_year(year, counts)
+            print(f"[service] added {year}")
+
+
+async def serve(service, host="127.0.0.1", port=8765, watch=60):
+    server = await asyncio.start_server(
+        lambda r, w: _serve_connection(service, r, w), host, port)
+    print(f"[service] listening on http://{host}:{port}")
+    if watch:
+        watcher = asyncio.create_task(_watch_releases(service, watch))
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            if watch:
+                watcher.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Household panel query service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=1024, help="responses kept in the LRU")
+    parser.add_argument("--watch", type=float, default=60,
+                        help="seconds between checks of Raw Data for a new year (0 = off)")
+    args = parser.parse_args(argv)
+    service = PanelService(cache_size=args.cache_size)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.watch))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
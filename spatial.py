@@ -0,0 +1,120 @@
+"""Spatial index over geography centroids for extent filters and neighbor lookups.
+
+Built once per set of points (PUMA, county or tract centroids):
+
+    idx = PointIndex.from_frame(household_counts)       # finds CENTLAT/CENTLON
+    us = idx.mask_bbox(*CONUS_BBOX)                     # replaces two between() scans
+    pos, km = idx.nearest(39.29, -76.61, k=5)
+    pos, km = idx.neighbors("7950000US2400804", k=10)   # excludes the PUMA itself
+
+Bounding boxes use the points sorted by longitude (a binary search, then a
+latitude check on that slice); radius and nearest-neighbor queries use a
+KD-tree on unit-sphere coordinates, so distances are great-circle km.
+"""
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0088
+
+# (west, south, east, north) used for the continental US maps
+CONUS_BBOX = (-125.0, 24.5, -66.0, 49.5)
+
+# Centroid column pairs found in the consolidated workbook and crosswalk files
+LATLON_COLUMNS = [("CENTLAT", "CENTLON"), ("INTPTLAT", "INTPTLON"), ("IntPtLat", "IntPtLon")]
+
+
+def _unit_xyz(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def _km_to_chord(km):
+    return 2 * np.sin(min(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+class PointIndex:
+    """Bounding-box, radius and k-nearest queries over lat/lon points.
+
+    Query results are row positions into the original points (so they can
+    index the frame the index was built from with .iloc) and, for distance
+    queries, great-circle distances in km. Points with a missing coordinate
+    are never returned.
+    """
+
+    def __init__(self, lat, lon, ids=None):
+        self.lat = np.asarray(lat, dtype="float64")
+        self.lon = np.asarray(lon, dtype="float64")
+        self.ids = pd.Index(range(len(self.lat)) if ids is None else ids)
+        self._pos = {}
+        self.valid = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+
+        by_lon = np.argsort(self.lon[self.valid], kind="stable")
+        self._lon_order = self.valid[by_lon]
+        self._lon_sorted = self.lon[self._lon_order]
+        self._tree = cKDTree(_unit_xyz(self.lat[self.valid], self.lon[self.valid]))
+
+    @classmethod
+    def from_frame(cls, df, lat_col=None, lon_col=None, id_col=None):
+        """Index a frame's centroids; the column pair is detected if not given."""
+        if lat_col is None:
+            for lat_col, lon_col in LATLON_COLUMNS:
+                if lat_col in df.columns and lon_col in df.columns:
+                    break
+            else:
+                raise KeyError(f"No centroid columns found; expected one of {LATLON_COLUMNS}")
+        ids = df.index if id_col is None else df[id_col]
+        return cls(pd.to_numeric(df[lat_col]), pd.to_numeric(df[lon_col]), ids)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def position(self, geo_id):
+        """Row position of one id."""
+        if not self._pos:
+            self._pos = {g: i for i, g in enumerate(self.ids)}
+        return self._pos[geo_id]
+
+    def bbox(self, west, south, east, north):
+        """Positions of points inside the box (edges included), in row order."""
+        lo = np.searchsorted(self._lon_sorted, west, side="left")
+        hi = np.searchsorted(self._lon_sorted, east, side="right")
+        cand = self._lon_order[lo:hi]
+        lat = self.lat[cand]
+        return np.sort(cand[(lat >= south) & (lat <= north)])
+
+    def mask_bbox(self, west, south, east, north):
+        """Boolean row mask for the box, a drop-in for lat/lon between() filters."""
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.bbox(west, south, east, north)] = True
+        return mask
+
+    def radius(self, lat, lon, km):
+        """Positions within `km` of (lat, lon), nearest first, and their distances."""
+        point = _unit_xyz([lat], [lon])[0]
+        hits = np.asarray(self._tree.query_ball_point(point, _km_to_chord(km)), dtype=np.intp)
+        dist = _chord_to_km(np.linalg.norm(self._tree.data[hits] - point, axis=1))
+        order = np.argsort(dist, kind="stable")
+        return self.valid[hits[order]], dist[order]
+
+    def nearest(self, lat, lon, k=1):
+        """The k nearest positions to (lat, lon), nearest first, and their distances."""
+        k = min(k, len(self.valid))
+        if k == 0:
+            return np.array([], dtype=np.intp), np.array([])
+        chord, hits = self._tree.query(_unit_xyz([lat], [lon])[0], k=k)
+        hits = np.atleast_1d(hits)
+        return self.valid[hits], _chord_to_km(np.atleast_1d(chord))
+
+    def neighbors(self, geo_id, k=10):
+        """The k nearest other points to the geography `geo_id`."""
+        i = self.position(geo_id)
+        pos, dist = self.nearest(self.lat[i], self.lon[i], k + 1)
+        keep = pos != i
+        return pos[keep][:k], dist[keep][:k]
@@ -0,0 +1,188 @@
+"""Table-only commands; nothing here imports matplotlib, cartopy or geopandas.
+
+    python tables.py top --level county --base 2019 --target 2023 -n 20
+    python tables.py top --level puma --base 2019 --target 2023 --state CA --min-base 50000
+    python tables.py series --level county --geo 06037
+    python tables.py near --geo 24510 -k 10 --base 2019 --target 2023
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+import pandas as pd
+
+import crosswalk
+from changes import changes_frame
+from ingest import CACHE_VERSION, RAW_DIR, available_years, build_long, build_wide, file_hash
+from instrument import span
+from ranking import top_k
+
+PANEL_COLUMNS = ["GEO_ID", "NAME", "S1901_C01_001E"]
+
+# Built panels are cached as Parquet beside the csv caches. Bump this when
+# household_panel or the crosswalk allocation changes so old panels are ignored
+PANEL_CACHE_VERSION = 1
+PANEL_CACHE_DIR = os.path.join(RAW_DIR, ".cache")
+
+# 2010-2011 use the 2000 PUMAs, which the crosswalks do not cover
+FIRST_YEAR = 2012
+
+
+def panel_years():
+    """Years with a release in Raw Data that the household panel covers (2012 onwards)."""
+    return [yr for yr in available_years() if yr >= FIRST_YEAR]
+
+
+def check_years(*years):
+    """Raise ValueError unless every year has a PUMA12/county panel column."""
+    usable = panel_years()
+    bad = [yr for yr in years if yr not in usable]
+    if bad:
+        raise ValueError(f"no household panel for {bad}; years are {usable}")
+
+
+def _panel_cache_path(level, years):
+    # Keyed on the year csvs and crosswalks the panel is built from
+    h = hashlib.sha1(f"{level}-{years}-{CACHE_VERSION}".encode())
+    sources = [os.path.join(RAW_DIR, f"{yr}.csv") for yr in years]
+    for path in sources + [crosswalk.PUMA12_TO_PUMA22_CSV, crosswalk.PUMA22_TO_COUNTY_CSV]:
+        h.update(file_hash(path).encode())
+    label = f"{years[0]}-{years[-1]}-{len(years)}" if years else "none"
+    return os.path.join(PANEL_CACHE_DIR, f"panel-{level}-{label}-v{PANEL_CACHE_VERSION}-"
+                                         f"{h.hexdigest()[:16]}.parquet")
+
+
+def household_panel(level="puma", years=None):
+    """Wide household counts ('Household_ct_<year>') with 'name' and 'stab' columns.
+
+    Both levels start in 2012 (2010-2011 use the 2000 PUMAs). level='puma' is
+    the 2012 PUMAs, with 2022+ reallocated from the 2022 PUMAs and names from
+    the crosswalk's PUMA12 names; level='county' reallocates each year
+    through the crosswalk matching its PUMA vintage. `years` defaults to
+    every release in Raw Data, so a new year's csv is picked up as it lands.
+
+    The panel is cached as Parquet until one of its csvs changes, so repeat
+    queries skip the crosswalks (and the scipy import) altogether.
+    """
+    if level not in ("puma", "county"):
+        raise ValueError(f"Unknown level {level!r}; use 'puma' or 'county'")
+    if years is None:
+        years = available_years()
+    years = [yr for yr in years if yr >= FIRST_YEAR]
+    cached = _panel_cache_path(level, years)
+    if os.path.exists(cached):
+        with span("tables.read_panel", level=level, years=len(years)):
+            return pd.read_parquet(cached)
+
+    panel = _build_panel(level, years)
+    os.makedirs(PANEL_CACHE_DIR, exist_ok=True)
+    # Drop older panels of the same level and years
+    prefix = os.path.basename(cached).rsplit("-v", 1)[0] + "-v"
+    for old in os.listdir(PANEL_CACHE_DIR):
+        if old.startswith(prefix) and old.endswith(".parquet"):
+            os.remove(os.path.join(PANEL_CACHE_DIR, old))
+    tmp = cached + ".tmp"
+    panel.to_parquet(tmp)
+    os.replace(tmp, cached)
+    return panel
+
+
+def _build_panel(level, years):
+    wide = build_wide(build_long(years, columns=PANEL_COLUMNS),
+                      values={"NAME": "NAME", "S1901_C01_001E": "Household_ct"})
+    if level == "puma":
+        counts = crosswalk.puma12_panel(wide, years)
+        info = crosswalk.puma12_info().reindex(counts.index)
+        counts.insert(0, "name", info["name"])
+        counts.insert(1, "stab", info["stab"])
+        return counts
+    counts = crosswalk.county_panel(wide, years)
+    info = crosswalk.county_info().reindex(counts.index)
+    counts.insert(0, "name", info["CountyName"])
+    counts.insert(1, "stab", info["stab"])
+    return counts
+
+
+def top_changes(level="county", base=2019, target=2023, n=20, metric="pct", largest=True,
+                state=None, min_base=None):
+    """Top (or bottom) n geographies by change between two years."""
+    check_years(base, target)
+    panel = household_panel(level, sorted({base, target}))
+    cols = {yr: f"Household_ct_{yr}" for yr in (base, target)}
+    name = {"pct": "Pct", "abs": "Abs", "cagr": "CAGR"}[metric]
+    panel = panel.join(changes_frame(panel, cols, pairs=[(base, target)], metrics=(metric,)))
+    col = f"{name}_{target}v{base}"
+    return top_k(panel, col, n, largest=largest, state=state, state_col="stab",
+                 min_base=min_base, base_col=cols[base])
+
+
+def neighbor_changes(geo, k=10, base=2019, target=2023, metric="pct"):
+    """A county and its k nearest counties (by population-weighted centroid) with their change."""
+    # scipy.spatial is slow to import and only this command needs it
+    from spatial import PointIndex
+
+    check_years(base, target)
+    geo = crosswalk.level_key(geo, "county")
+    panel = household_panel("county", sorted({base, target}))
+    if geo not in panel.index:
+        raise ValueError(f"unknown county {geo!r}")
+    pts = crosswalk.county_centroids().reindex(panel.index)
+    pos, km = PointIndex.from_frame(pts).neighbors(geo, k)
+    rows = panel.iloc[[pts.index.get_loc(geo), *pos]]
+    cols = {yr: f"Household_ct_{yr}" for yr in (base, target)}
+    name = {"pct": "Pct", "abs": "Abs", "cagr": "CAGR"}[metric]
+    out = rows.join(changes_frame(rows, cols, pairs=[(base, target)], metrics=(metric,)))
+    out.insert(2, "km", [0.0, *km.round(1)])
+    return out[["name", "stab", "km", cols[base], cols[target], f"{name}_{target}v{base}"]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Household formation tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    top = sub.add_parser("top", help="top/bottom N geographies by change")
+    top.add_argument("--level", choices=["puma", "county"], default="county")
+    top.add_argument("--base", type=int, default=2019)
+    top.add_argument("--target", type=int, default=2023)
+    top.add_argument("-n", type=int, default=20)
+    top.add_argument("--metric", choices=["pct", "abs", "cagr"], default="pct")
+    top.add_argument("--bottom", action="store_true", help="largest declines instead")
+    top.add_argument("--state", help="state abbreviation, e.g. CA")
+    top.add_argument("--min-base", type=float, help="minimum base-year households")
+
+    series = sub.add_parser("series", help="household counts for one geography")
+    series.add_argument("--level", choices=["puma", "county"], default="county")
+    series.add_argument("--geo", required=True, help="GEO_ID or county FIPS")
+
+    near = sub.add_parser("near", help="a county next to its nearest counties")
+    near.add_argument("--geo", required=True, help="county FIPS")
+    near.add_argument("-k", type=int, default=10)
+    near.add_argument("--base", type=int, default=2019)
+    near.add_argument("--target", type=int, default=2023)
+    near.add_argument("--metric", choices=["pct", "abs", "cagr"], default="pct")
+
+    args = parser.parse_args(argv)
+    pd.set_option("display.width", 200)
+    pd.set_option("display.max_columns", 20)
+    try:
+        if args.command == "top":
+            if args.n < 1:
+                parser.error("-n must be at least 1")
+            print(top_changes(args.level, args.base, args.target, args.n, args.metric,
+                              largest=not args.bottom, state=args.state,
+                              min_base=args.min_base))
+        elif args.command == "series":
+            geo = crosswalk.level_key(args.geo, args.level)
+            panel = household_panel(args.level)
+            if geo not in panel.index:
+                raise ValueError(f"unknown {args.level} {args.geo!r}")
+            print(panel.loc[geo].to_string())
+        elif args.command == "near":
+            print(neighbor_changes(args.geo, args.k, args.base, args.target, args.metric))
+    except ValueError as exc:
+        parser.error(str(exc))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
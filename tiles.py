@@ -0,0 +1,281 @@
+"""XYZ tile pyramids of the household-count and percent-change point layers.
+
+    python tiles.py                              # county layers, zoom 3-7
+    python tiles.py --zooms 2-9 --workers 8 --force
+
+Tiles are 256 px Web Mercator PNGs with a transparent background, written
+as tiles/<metric>/<year>/<z>/<x>/<y>.png so any slippy-map viewer can lay
+them over a basemap, e.g. in Leaflet
+
+    L.tileLayer("http://127.0.0.1:8765/tiles/county_pct_change/2023/{z}/{x}/{y}.png")
+
+Every tile of a layer is colored with one fixed Normalize/cmap, so colors
+match across tiles, zoom levels and years. Points are stamped straight into
+the tile arrays (no figure per tile), each (layer, zoom) is one task for a
+process pool, and a layer whose values, points and style are unchanged is
+skipped. Metrics are named by geography (county_households,
+puma_pct_change, ...) so the county pyramids of this module and the PUMA
+ones of "Mapping out household counts.py" share tiles/ without overwriting
+each other; tiles/tiles.json lists every metric's color scale, years and
+zooms across runs.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from instrument import span
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TILES_DIR = os.path.join(BASE_DIR, "tiles")
+TILE_SIZE = 256
+
+# Color scales of the PUMA maps in "Mapping out household counts.py"
+HOUSEHOLD_STYLE = {"vmin": 25367, "vmax": 120000, "cmap": "viridis"}
+PCT_CHANGE_STYLE = {"vmin": -25, "vmax": 25, "cmap": "RdYlBu_r"}
+
+# County household counts span far more than PUMAs do, so "Plotting by County.py"
+# scales them to the 5th-95th percentile of 2013 instead
+COUNTY_SCALE_YEAR = 2013
+COUNTY_SCALE_PERCENTILES = (5, 95)
+
+MAX_LAT = 85.05112878
+
+# Per-process points, set up by _init_worker
+_POINTS = {}
+
+
+def tile_layer(metric, year, values, vmin, vmax, cmap="viridis", alpha=0.8):
+    """One layer of the pyramid: a value per point and its fixed color scale."""
+    return {"metric": metric, "year": year, "values": np.asarray(values, dtype="float64"),
+            "vmin": vmin, "vmax": vmax, "cmap": cmap, "alpha": alpha}
+
+
+def year_layers(values_by_year, metric, vmin, vmax, cmap="viridis", alpha=0.8):
+    return [tile_layer(metric, yr, values, vmin, vmax, cmap, alpha)
+            for yr, values in values_by_year.items()]
+
+
+def lonlat_to_pixel(lon, lat, z):
+    """Global Web Mercator pixel coordinates at zoom z."""
+    scale = TILE_SIZE * 2 ** z
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    x = (np.asarray(lon, dtype="float64") + 180) / 360 * scale
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * scale
+    return x, y
+
+
+def point_radius(z):
+    """Marker radius in pixels; markers grow with zoom like a fixed-size scatter."""
+    return int(np.clip(z, 2, 12))
+
+
+def _disk(radius):
+    d = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(d, d, indexing="ij")
+    keep = dx ** 2 + dy ** 2 <= radius ** 2 + radius * 0.5
+    return dy[keep], dx[keep]
+
+
+def layer_colors(layer):
+    """RGBA (uint8) per point from the layer's Normalize/cmap; NaN values get alpha 0."""
+    from matplotlib import colormaps
+    from matplotlib.colors import Normalize
+
+    norm = Normalize(vmin=layer["vmin"], vmax=layer["vmax"], clip=True)
+    values = layer["values"]
+    rgba = colormaps[layer["cmap"]](norm(np.nan_to_num(values)), alpha=layer["alpha"],
+                                    bytes=True)
+    rgba[np.isnan(values), 3] = 0
+    return rgba
+
+
+def _init_worker(lon, lat):
+    _POINTS["lon"] = lon
+    _POINTS["lat"] = lat
+
+
+def render_zoom(task):
+    """Write every non-empty tile of one layer at one zoom; returns the tile count."""
+    from matplotlib.image import imsave
+
+    layer_dir, rgba, z = task
+    show = (rgba[:, 3] > 0) & np.isfinite(_POINTS["lon"]) & np.isfinite(_POINTS["lat"])
+    x, y = lonlat_to_pixel(_POINTS["lon"][show], _POINTS["lat"][show], z)
+    rgba = rgba[show]
+    radius = point_radius(z)
+    edge = radius + 1
+
+    # Points near a tile edge are stamped into every tile their marker touches
+    tx = np.stack([np.floor((x - edge) / TILE_SIZE), np.floor((x + edge) / TILE_SIZE)] * 2)
+    ty = np.repeat(np.stack([np.floor((y - edge) / TILE_SIZE),
+                             np.floor((y + edge) / TILE_SIZE)]), 2, axis=0)
+    pt = np.broadcast_to(np.arange(len(x)), tx.shape)
+    pieces = np.unique(np.column_stack([tx.ravel(), ty.ravel(), pt.ravel()]).astype(np.int64),
+                       axis=0)
+    n_tiles = 2 ** z
+    pieces = pieces[(pieces[:, 0] >= 0) & (pieces[:, 0] < n_tiles)
+                    & (pieces[:, 1] >= 0) & (pieces[:, 1] < n_tiles)]
+    if not len(pieces):
+        return 0
+    starts = np.flatnonzero(np.r_[True, (np.diff(pieces[:, :2], axis=0) != 0).any(axis=1)])
+
+    outline = _disk(edge)
+    fill = _disk(radius)
+    white = np.array([255, 255, 255, 204], dtype=np.uint8)
+    written = 0
+    with span("tiles.zoom", z=z, tiles=len(starts)):
+        for start, stop in zip(starts, np.r_[starts[1:], len(pieces)]):
+            col, row = pieces[start, :2]
+            pts = np.sort(pieces[start:stop, 2])
+            px = np.rint(x[pts] - col * TILE_SIZE).astype(np.int64)
+            py = np.rint(y[pts] - row * TILE_SIZE).astype(np.int64)
+            img = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+            for (dy, dx), color in ((outline, white), (fill, rgba[pts])):
+                for oy, ox in zip(dy, dx):
+                    X, Y = px + ox, py + oy
+                    ok = (X >= 0) & (X < TILE_SIZE) & (Y >= 0) & (Y < TILE_SIZE)
+                    img[Y[ok], X[ok]] = color if color.ndim == 1 else color[ok]
+            path = os.path.join(layer_dir, str(z), str(col), f"{row}.png")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            imsave(path, img)
+            written += 1
+    return written
+
+
+def _layer_hash(layer, rgba, lon, lat, zooms):
+    h = hashlib.sha1()
+    for arr in (rgba, lon, lat):
+        h.update(np.ascontiguousarray(arr).tobytes())
+    h.update(json.dumps([list(zooms), layer["vmin"], layer["vmax"], layer["cmap"]]).encode())
+    return h.hexdigest()
+
+
+def render_tiles(layers, lon, lat, zooms=range(3, 8), out_dir=TILES_DIR, workers=None,
+                 force=False):
+    """Render the pyramid for every layer; returns {(metric, year): tiles or 'cached'}."""
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    zooms = list(zooms)
+    status = {}
+    tasks = []
+    pending = {}
+    for layer in layers:
+        rgba = layer_colors(layer)
+        layer_dir = os.path.join(out_dir, layer["metric"], str(layer["year"]))
+        meta_path = os.path.join(layer_dir, "layer.json")
+        digest = _layer_hash(layer, rgba, lon, lat, zooms)
+        if not force and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f).get("hash") == digest:
+                    status[(layer["metric"], layer["year"])] = "cached"
+                    continue
+        shutil.rmtree(layer_dir, ignore_errors=True)
+        pending[layer_dir] = (layer, digest, [])
+        # Deepest zooms first, they have the most tiles
+        tasks += [(layer_dir, rgba, z) for z in sorted(zooms, reverse=True)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks) or 1))
+    with span("tiles.render_tiles", tasks=len(tasks), workers=workers):
+        if workers == 1:
+            _init_worker(lon, lat)
+            counts = [render_zoom(task) for task in tasks]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(lon, lat)) as pool:
+                counts = list(pool.map(render_zoom, tasks))
+
+    for (layer_dir, _, _), count in zip(tasks, counts):
+        pending[layer_dir][2].append(count)
+    for layer_dir, (layer, digest, done) in pending.items():
+        # Written last, so an interrupted layer is re-rendered next time
+        os.makedirs(layer_dir, exist_ok=True)
+        with open(os.path.join(layer_dir, "layer.json"), "w") as f:
+            json.dump({"hash": digest, "zooms": zooms, "tiles": sum(done)}, f)
+        status[(layer["metric"], layer["year"])] = sum(done)
+    _write_index(layers, zooms, out_dir)
+    return status
+
+
+def _write_index(layers, zooms, out_dir):
+    """Merge this run's layers into tiles/tiles.json, keeping the other metrics and years.
+
+    Each metric lists its color scale and the zooms rendered for each year.
+    """
+    path = os.path.join(out_dir, "tiles.json")
+    index = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f).get("layers", {})
+    for layer in layers:
+        style = {"vmin": layer["vmin"], "vmax": layer["vmax"], "cmap": layer["cmap"]}
+        entry = index.get(layer["metric"])
+        # Years left from a run with another scale would not match this one's colors
+        if entry is None or {k: entry.get(k) for k in style} != style:
+            entry = index[layer["metric"]] = dict(style, years={})
+        entry["years"][str(layer["year"])] = zooms
+        entry["years"] = dict(sorted(entry["years"].items()))
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"tile_size": TILE_SIZE, "layers": index}, f, indent=1)
+    os.replace(tmp, path)
+
+
+def county_layers():
+    """Household-count and year-over-year percent-change layers for counties.
+
+    The household color scale is the 5th-95th percentile of 2013 as in
+    "Plotting by County.py", not the fixed PUMA scale (HOUSEHOLD_STYLE) of
+    the mapping script. Percent changes use the mapping script's +/-25%
+    (PCT_CHANGE_STYLE).
+    Returns (layers, lon, lat).
+    """
+    import crosswalk
+    from changes import changes_frame, yoy_pairs
+    from tables import household_panel
+
+    panel = household_panel("county")
+    years = sorted(int(c.rsplit("_", 1)[1]) for c in panel.columns
+                   if c.startswith("Household_ct_"))
+    cols = {yr: f"Household_ct_{yr}" for yr in years}
+    pct = changes_frame(panel, cols, pairs=yoy_pairs(years), metrics=("pct",),
+                        fmt="pct_change_{target}")
+    pts = crosswalk.county_centroids().reindex(panel.index)
+
+    base = panel[cols.get(COUNTY_SCALE_YEAR, cols[years[0]])].dropna()
+    vmin, vmax = np.percentile(base, COUNTY_SCALE_PERCENTILES)
+    layers = year_layers({yr: panel[cols[yr]] for yr in years}, "county_households",
+                         vmin=float(vmin), vmax=float(vmax), cmap=HOUSEHOLD_STYLE["cmap"])
+    layers += year_layers({yr: pct[f"pct_change_{yr}"] for yr in years[1:]}, "county_pct_change",
+                          **PCT_CHANGE_STYLE)
+    return layers, pts["IntPtLon"], pts["IntPtLat"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render XYZ tile pyramids of the county layers")
+    parser.add_argument("--zooms", default="3-7", help="zoom range, e.g. 2-9")
+    parser.add_argument("--out", default=TILES_DIR)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--force", action="store_true", help="re-render unchanged layers")
+    args = parser.parse_args(argv)
+
+    lo, _, hi = args.zooms.partition("-")
+    zooms = range(int(lo), int(hi or lo) + 1)
+    layers, lon, lat = county_layers()
+    status = render_tiles(layers, lon, lat, zooms, args.out, workers=args.workers,
+                          force=args.force)
+    rendered = {k: v for k, v in status.items() if v != "cached"}
+    print(f"[tiles] {len(rendered)} layer(s) rendered ({sum(rendered.values())} tiles), "
+          f"{len(status) - len(rendered)} unchanged, under {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Margin-of-error propagation for ACS estimates.
+
+ACS MOEs are published at the 90% level (SE = MOE / 1.645). The functions
+below use the Census Bureau's approximation formulas ("Understanding and
+Using ACS Data", ch. 8) and work on whole (geography x year) arrays at once.
+"""
+import numpy as np
+
+from changes import pair_indices
+
+Z90 = 1.645
+
+
+def moe_sum(moes, axis=None):
+    """MOE of a sum of estimates: sqrt(sum of squared MOEs)."""
+    moes = np.asarray(moes, dtype="float64")
+    return np.sqrt(np.nansum(moes ** 2, axis=axis))
+
+
+def moe_diff(moe_a, moe_b):
+    """MOE of a - b (same as for a + b)."""
+    return np.hypot(moe_a, moe_b)
+
+
+def moe_ratio(num, den, moe_num, moe_den):
+    """MOE of num / den when num is not a subset of den."""
+    num, den = np.asarray(num, dtype="float64"), np.asarray(den, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = num / den
+        out = np.sqrt(moe_num ** 2 + ratio ** 2 * moe_den ** 2) / np.abs(den)
+    return np.where(den != 0, out, np.nan)
+
+
+def moe_proportion(num, den, moe_num, moe_den):
+    """MOE of num / den when num is a subset of den.
+
+    Falls back to the ratio formula where the term under the root is negative,
+    as the Census guidance recommends.
+    """
+    num, den = np.asarray(num, dtype="float64"), np.asarray(den, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prop = num / den
+        under = moe_num ** 2 - prop ** 2 * moe_den ** 2
+        out = np.where(under >= 0, np.sqrt(np.abs(under)) / np.abs(den),
+                       moe_ratio(num, den, moe_num, moe_den))
+    return np.where(den != 0, out, np.nan)
+
+
+def moe_pct_change(base, target, moe_base, moe_target):
+    """MOE (in percentage points) of 100 * (target - base) / base."""
+    return 100 * moe_ratio(target, base, moe_target, moe_base)
+
+
+def change_moes(values, moes, years, pairs=None):
+    """MOEs for compute_changes' 'abs' and 'pct' metrics, for every pair at once.
+
+    `values` and `moes` are (geography x year) arrays in the same column order
+    as `years`. Returns ({'abs': ..., 'pct': ...}, pairs).
+    """
+    values = np.asarray(values, dtype="float64")
+    moes = np.asarray(moes, dtype="float64")
+    base_idx, target_idx, pairs = pair_indices(years, pairs)
+    base, target = values[:, base_idx], values[:, target_idx]
+    moe_b, moe_t = moes[:, base_idx], moes[:, target_idx]
+    return {
+        "abs": moe_diff(moe_b, moe_t),
+        "pct": moe_pct_change(base, target, moe_b, moe_t),
+    }, pairs
+
+
+def is_significant(estimate, moe, level=0.90):
+    """True where estimate differs from 0 at the given confidence level.
+
+    `estimate` is typically an 'abs' change and `moe` its change_moes MOE;
+    a percent change is significant exactly when the underlying difference is.
+    """
+    from statistics import NormalDist
+
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    se = np.asarray(moe, dtype="float64") / Z90
+    with np.errstate(invalid="ignore"):
+        return np.abs(estimate) > z * se
+
+
+def allocate_moe(crosswalk, moes, keys=None):
+    """MOE of crosswalk.apply(values): each target is a sum of a_ij * x_j pieces.
+
+    The MOE of a_ij * x_j is a_ij * MOE_j, so the target MOE is
+    sqrt((A o A) @ MOE^2); missing MOEs count as 0.
+    """
+    sq = np.nan_to_num(np.asarray(moes, dtype="float64")) ** 2
+    if keys is not None:
+        sq = crosswalk.align(keys) @ sq
+    return np.sqrt(crosswalk.matrix.power(2) @ sq)
+
+
+def monte_carlo(func, values, moes, n_draws=1000, seed=0, batch=100):
+    """Simulate func(values) under normal sampling error; returns (mean, moe90).
+
+    Draws are made in batches of `batch` with shape (batch, *values.shape) and
+    `func` must accept that leading draw axis (any NumPy expression over the
+    last axes does). The returned MOE is 1.645 x the draw standard deviation.
+    """
+    values = np.asarray(values, dtype="float64")
+    se = np.asarray(moes, dtype="float64") / Z90
+    rng = np.random.default_rng(seed)
+    total = total_sq = None
+    done = 0
+    while done < n_draws:
+        size = min(batch, n_draws - done)
+        draws = values + rng.standard_normal((size,) + values.shape) * se
+        out = np.asarray(func(draws), dtype="float64")
+        s, s2 = np.nansum(out, axis=0), np.nansum(out ** 2, axis=0)
+        total = s if total is None else total + s
+        total_sq = s2 if total_sq is None else total_sq + s2
+        done += size
+    mean = total / n_draws
+    var = np.maximum(total_sq / n_draws - mean ** 2, 0)
+    return mean, Z90 * np.sqrt(var)
@@ -0,0 +1,129 @@
+import json
+import os
+import re
+
+import pandas as pd
+
+from ingest import file_hash
+from instrument import span
+
+# Bump this when normalize_sheet or the snapshot format changes so old snapshots are ignored
+SNAPSHOT_VERSION = 1
+
+
+def _cache_dir_for(xlsx_path):
+    return os.path.join(os.path.dirname(os.path.abspath(xlsx_path)), ".cache")
+
+
+def workbook_hash(xlsx_path, cache_dir=None):
+    """sha1 of the workbook, re-hashed only when its mtime or size changes."""
+    cache_dir = cache_dir or _cache_dir_for(xlsx_path)
+    index_path = os.path.join(cache_dir, "workbooks.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    key = os.path.abspath(xlsx_path)
+    st = os.stat(xlsx_path)
+    rec = index.get(key)
+    if rec and rec["mtime"] == st.st_mtime_ns and rec["size"] == st.st_size:
+        return rec["sha1"]
+
+    digest = file_hash(xlsx_path)
+    index[key] = {"mtime": st.st_mtime_ns, "size": st.st_size, "sha1": digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = index_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, index_path)
+    return digest
+
+
+def normalize_sheet(df, skip_rows=0):
+    """Tidy a parsed sheet: strip header text, drop empty rows/columns, fix dtypes.
+
+    Object columns that are entirely numeric become float64; the rest become
+    strings (NaN kept). Year headers such as 2012 stay integers.
+    """
+    if skip_rows:
+        df = df.iloc[skip_rows:]
+    df = df.dropna(how="all").dropna(axis=1, how="all")
+    df = df.loc[:, [not (isinstance(c, str) and c.startswith("Unnamed:")) for c in df.columns]]
+    df.columns = [c.strip() if isinstance(c, str) else
+                  int(c) if isinstance(c, float) and c.is_integer() else c
+                  for c in df.columns]
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if df[col].dtype == object:
+            as_num = pd.to_numeric(df[col], errors="coerce")
+            if as_num.notna().sum() == df[col].notna().sum():
+                df[col] = as_num.astype("float64")
+            else:
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _snapshot_path(xlsx_path, digest, sheet_name, header, skip_rows, cache_dir):
+    stem = os.path.splitext(os.path.basename(xlsx_path))[0]
+    sheet = re.sub(r"[^A-Za-z0-9]+", "_", str(sheet_name)).strip("_")
+    return os.path.join(cache_dir, f"{stem}-v{SNAPSHOT_VERSION}-{digest[:16]}-{sheet}"
+                                   f"-h{header}-s{skip_rows}.parquet")
+
+
+def _write_snapshot(df, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Parquet needs string column names; remember which ones were integers
+    names = [[isinstance(c, int), str(c)] for c in df.columns]
+    table = pa.Table.from_pandas(df.set_axis([str(c) for c in df.columns], axis=1),
+                                 preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[b"hh_columns"] = json.dumps(names).encode()
+    tmp = path + ".tmp"
+    pq.write_table(table.replace_schema_metadata(meta), tmp)
+    os.replace(tmp, path)
+
+
+def _read_snapshot(path):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    df = table.to_pandas()
+    names = json.loads(table.schema.metadata[b"hh_columns"])
+    df.columns = [int(name) if is_int else name for is_int, name in names]
+    return df
+
+
+def read_sheets(xlsx_path, sheets, cache_dir=None):
+    """Read several sheets through the Parquet snapshot cache.
+
+    `sheets` maps sheet name (or index) -> header row, or -> (header row, rows
+    to skip after the header). Sheets missing from the cache are parsed from a
+    single open of the workbook. Returns {sheet: frame}.
+    """
+    cache_dir = cache_dir or _cache_dir_for(xlsx_path)
+    digest = workbook_hash(xlsx_path, cache_dir)
+    specs = {s: (h if isinstance(h, tuple) else (h, 0)) for s, h in sheets.items()}
+    paths = {s: _snapshot_path(xlsx_path, digest, s, h, skip, cache_dir)
+             for s, (h, skip) in specs.items()}
+
+    with span("excel.read_snapshot", workbook=os.path.basename(xlsx_path)):
+        out = {s: _read_snapshot(p) for s, p in paths.items() if os.path.exists(p)}
+    missing = [s for s in specs if s not in out]
+    if missing:
+        os.makedirs(cache_dir, exist_ok=True)
+        with pd.ExcelFile(xlsx_path) as xl:
+            for s in missing:
+                header, skip = specs[s]
+                with span("excel.parse", sheet=str(s)):
+                    df = normalize_sheet(xl.parse(s, header=header), skip_rows=skip)
+                _write_snapshot(df, paths[s])
+                out[s] = df
+    return {s: out[s] for s in specs}
+
+
+def read_sheet(xlsx_path, sheet_name=0, header=0, skip_rows=0, cache_dir=None):
+    """Cached, typed replacement for pd.read_excel(xlsx_path, sheet_name, header=header)."""
+    return read_sheets(xlsx_path, {sheet_name: (header, skip_rows)}, cache_dir)[sheet_name]